@@ -0,0 +1,87 @@
+import datetime
+
+from sqlalchemy import Date, case, delete, func, insert, select
+
+from models import Order, OrderDailySummary
+
+STATUS_KEYS = [key for key, _ in Order.ORDER_STATUSES]
+
+
+def order_day():
+    return func.date(Order.created_at, type_=Date)
+
+
+def group_column(model, group_by):
+    if group_by == 'product':
+        return model.product_id
+    if group_by == 'user':
+        return model.user_id
+    return order_day() if model is Order else model.day
+
+
+def order_analytics(group_by, start=None, end=None):
+    """Revenue, counts and per-status counts grouped in SQL, straight from orders."""
+    key = group_column(Order, group_by).label('key')
+    query = select(
+        key,
+        func.count(Order.id).label('order_count'),
+        func.coalesce(func.sum(Order.quantity), 0).label('quantity'),
+        func.coalesce(func.sum(Order.total_price), 0).label('revenue'),
+        *[func.sum(case((Order.order_statuses == status, 1), else_=0)).label(status) for status in STATUS_KEYS]
+    ).group_by(key).order_by(key)
+    if start is not None:
+        query = query.where(Order.created_at >= start)
+    if end is not None:
+        query = query.where(Order.created_at < end + datetime.timedelta(days=1))
+    return query
+
+
+def summary_analytics(group_by, start=None, end=None):
+    """Same shape as order_analytics, read from the refreshed daily summary."""
+    summary = OrderDailySummary
+    key = group_column(summary, group_by).label('key')
+    query = select(
+        key,
+        func.sum(summary.order_count).label('order_count'),
+        func.sum(summary.quantity).label('quantity'),
+        func.sum(summary.revenue).label('revenue'),
+        *[func.sum(case((summary.order_statuses == status, summary.order_count), else_=0)).label(status)
+          for status in STATUS_KEYS]
+    ).group_by(key).order_by(key)
+    if start is not None:
+        query = query.where(summary.day >= start)
+    if end is not None:
+        query = query.where(summary.day <= end)
+    return query
+
+
+def analytics_row(row):
+    return {
+        "key": row.key,
+        "order_count": row.order_count,
+        "quantity": row.quantity,
+        "revenue": row.revenue,
+        "statuses": {status: getattr(row, status) for status in STATUS_KEYS}
+    }
+
+
+async def refresh_order_summary(session):
+    """Rebuilds order_daily_summary in one transaction; returns the number of summary rows."""
+    day = order_day()
+    rollup = select(
+        day,
+        Order.product_id,
+        Order.user_id,
+        Order.order_statuses,
+        func.count(Order.id),
+        func.coalesce(func.sum(Order.quantity), 0),
+        func.coalesce(func.sum(Order.total_price), 0)
+    ).group_by(day, Order.product_id, Order.user_id, Order.order_statuses)
+
+    await session.execute(delete(OrderDailySummary))
+    result = await session.execute(insert(OrderDailySummary).from_select(
+        ['day', 'product_id', 'user_id', 'order_statuses', 'order_count', 'quantity', 'revenue'],
+        rollup
+    ))
+    await session.commit()
+    return result.rowcount
@@ -1,22 +1,24 @@
 import datetime
 
-from fastapi import APIRouter, status, Depends
+from fastapi import APIRouter, status, Depends, Request
 from fastapi.encoders import jsonable_encoder
 from fastapi_jwt_auth import AuthJWT
 from fastapi.exceptions import HTTPException
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import or_, select
 
-from schemas import SignUpModel, LoginModel
-from database import session, engine
+from schemas import SignUpModel, LoginModel, LogoutModel
+from database import get_db
 from models import User
+from denylist import denylist
+from dependencies import (VerifiedToken, bearer_token, get_verified_token, invalidate_user, token_cache,
+                          token_key, user_claims)
+from security import hash_password, verify_password, needs_rehash
 
 auth_router = APIRouter(
     prefix='/auth'
 )
 
-session = session(bind=engine)
-
 
 @auth_router.get('/')
 async def welcome(Authorize: AuthJWT = Depends()):
@@ -28,13 +30,13 @@ async def welcome(Authorize: AuthJWT = Depends()):
 
 
 @auth_router.post('/signup', status_code=status.HTTP_201_CREATED)
-async def signup(user: SignUpModel):
-    db_email = session.query(User).filter(User.email == user.email).first()
+async def signup(user: SignUpModel, session: AsyncSession = Depends(get_db)):
+    db_email = await session.scalar(select(User).where(User.email == user.email))
     if db_email is not None:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                              detail='User with this email already exists')
 
-    db_username = session.query(User).filter(User.username == user.username).first()
+    db_username = await session.scalar(select(User).where(User.username == user.username))
     if db_username is not None:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                              detail='User with this username already exists')
@@ -42,13 +44,14 @@ async def signup(user: SignUpModel):
     new_user = User(
         username=user.username,
         email=user.email,
-        password=generate_password_hash(user.password),
+        password=await hash_password(user.password),
         is_active=user.is_active,
         is_staff=user.is_staff
     )
 
     session.add(new_user)
-    session.commit()
+    await session.commit()
+    invalidate_user(new_user.username)
 
     data = {
         'id': new_user.id,
@@ -69,20 +72,25 @@ async def signup(user: SignUpModel):
 
 
 @auth_router.post('/login', status_code=status.HTTP_200_OK)
-async def login(user: LoginModel, Authorize: AuthJWT = Depends()):
+async def login(user: LoginModel, session: AsyncSession = Depends(get_db), Authorize: AuthJWT = Depends()):
     # db_user = session.query(User).filter(User.username == user.username).first()
 
-    db_user = session.query(User).filter(
+    db_user = await session.scalar(select(User).where(
         or_(
             User.username == user.username_or_email,
             User.email == user.username_or_email
         )
-    ).first()
+    ))
+
+    if db_user and await verify_password(db_user.password, user.password):
+        if await needs_rehash(db_user.password):
+            db_user.password = await hash_password(user.password)
+            await session.commit()
 
-    if db_user and check_password_hash(db_user.password, user.password):
         access_lifetime = datetime.timedelta(minutes=60)
         refresh_lifetime = datetime.timedelta(days=3)
-        access_token = Authorize.create_access_token(subject=db_user.username, expires_time=access_lifetime)
+        access_token = Authorize.create_access_token(subject=db_user.username, expires_time=access_lifetime,
+                                                     user_claims=user_claims(db_user))
         refresh_token = Authorize.create_refresh_token(subject=db_user.username, expires_time=refresh_lifetime)
 
         token = {
@@ -102,18 +110,23 @@ async def login(user: LoginModel, Authorize: AuthJWT = Depends()):
 
 
 @auth_router.get('/login/refresh')
-async def refresh_token(Authorize: AuthJWT = Depends()):
+async def refresh_token(session: AsyncSession = Depends(get_db), Authorize: AuthJWT = Depends()):
     try:
         access_lifetime = datetime.timedelta(minutes=60)
         Authorize.jwt_refresh_token_required()
         current_user = Authorize.get_jwt_subject()
 
-        db_user = session.query(User).filter(User.username == current_user).first()
+        await denylist.sync(session)
+        if Authorize.get_raw_jwt()['jti'] in denylist:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token has been revoked")
+
+        db_user = await session.scalar(select(User).where(User.username == current_user))
 
         if db_user is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found!")
 
-        new_access_token = Authorize.create_access_token(subject=db_user.username, expires_time=access_lifetime)
+        new_access_token = Authorize.create_access_token(subject=db_user.username, expires_time=access_lifetime,
+                                                         user_claims=user_claims(db_user))
 
         response_model = {
             "success": True,
@@ -126,5 +139,34 @@ async def refresh_token(Authorize: AuthJWT = Depends()):
 
         return response_model
 
+    except HTTPException:
+        # raised above on purpose (e.g. a revoked token); the client should see why
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+
+
+@auth_router.post('/logout', status_code=status.HTTP_200_OK)
+async def logout(request: Request, body: LogoutModel = None, session: AsyncSession = Depends(get_db),
+                 Authorize: AuthJWT = Depends(), verified: VerifiedToken = Depends(get_verified_token)):
+    refresh_claims = None
+    if body and body.refresh:
+        try:
+            refresh_claims = Authorize.get_raw_jwt(body.refresh)
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid refresh token")
+        if refresh_claims.get('type') != 'refresh' or refresh_claims.get('sub') != verified.user.username:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid refresh token")
+
+    await denylist.revoke(session, verified.jti, verified.expires_at)
+    token_cache.delete(token_key(bearer_token(request)))
+    if refresh_claims:
+        await denylist.revoke(session, refresh_claims['jti'], refresh_claims['exp'])
+
+    response = {
+        "success": True,
+        "code": 200,
+        "message": "User successfully logged out",
+        "data": None
+    }
+    return jsonable_encoder(response)
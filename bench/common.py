@@ -0,0 +1,75 @@
+"""Setup shared by the bench scripts that seed their own data.
+
+Seeding drops every table first, so these scripts never use DATABASE_URL:
+the database is named with --database or BENCH_DATABASE_URL, and anything
+other than SQLite also needs --allow-non-sqlite. configure() must run before
+anything imports database.py, which creates its engines at import time.
+
+    python bench/throughput.py --database sqlite+aiosqlite:///./bench.db
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy.engine import make_url
+
+# the app's engine needs some URL to import; nothing is ever written here
+PLACEHOLDER_DATABASE_URL = 'sqlite+aiosqlite://'
+
+database_url = None
+
+
+def add_database_arguments(parser):
+    parser.add_argument('--database', help='database to drop and seed; defaults to $BENCH_DATABASE_URL')
+    parser.add_argument('--allow-non-sqlite', action='store_true',
+                        help='allow --database to name a server database; its tables are dropped')
+    return parser
+
+
+def display(url):
+    return make_url(url).render_as_string(hide_password=True)
+
+
+def configure(default=None):
+    """Points DATABASE_URL at the bench database and turns shedding off.
+
+    default is for checks that bring their own throwaway database; without
+    one and without --database, DATABASE_URL gets a placeholder that is
+    never written to.
+    """
+    global database_url
+    args, _ = add_database_arguments(argparse.ArgumentParser(add_help=False)).parse_known_args()
+    url = args.database or os.getenv('BENCH_DATABASE_URL') or default
+    if url is not None and make_url(url).get_backend_name() != 'sqlite' and not args.allow_non_sqlite:
+        sys.exit(f"Refusing to drop the tables of {display(url)}; pass --allow-non-sqlite if that is intended")
+    database_url = url
+    os.environ['DATABASE_URL'] = url or PLACEHOLDER_DATABASE_URL
+    # measure the app itself, not the rate limiter's shedding
+    os.environ.setdefault('RATE_LIMIT_RULES', '')
+    os.environ.setdefault('MAX_CONCURRENT_REQUESTS', '0')
+
+
+async def reset_schema():
+    """Drops and recreates every table of the bench database."""
+    if database_url is None:
+        sys.exit("Name the database to seed with --database or BENCH_DATABASE_URL "
+                 "(e.g. sqlite+aiosqlite:///./bench.db); its tables are dropped first")
+    from database import Base, engine
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+
+def access_headers(user_id, is_staff, username=None):
+    """A bearer token minted directly, so runs don't pay for a login per client."""
+    from fastapi_jwt_auth import AuthJWT
+
+    from dependencies import user_claims
+    from models import User
+
+    user = User(id=user_id, is_staff=is_staff)
+    token = AuthJWT().create_access_token(subject=username or f'user{user_id}', user_claims=user_claims(user))
+    return {'Authorization': f'Bearer {token}'}
@@ -0,0 +1,136 @@
+"""Checks that parallel requests get their own pooled sessions instead of queueing on one.
+
+Fires --requests listing requests at once, --concurrency in flight, and
+watches the pool's checkout/checkin events. With one session per request,
+connections are checked out side by side (never more than the pool holds);
+a session shared by every request would keep a single connection out at a
+time. Also times the same requests one after another. Exits 1 unless more
+than one connection was out at once and every request succeeded.
+
+    python bench/concurrency.py --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import common
+
+DIRECTORY = tempfile.mkdtemp(prefix='concurrency-')
+common.configure(default=f"sqlite+aiosqlite:///{os.path.join(DIRECTORY, 'concurrency.db')}")
+
+import httpx
+from sqlalchemy import event, insert
+
+from database import SessionLocal, engine
+from main import app
+from models import Order, Product, User
+
+
+async def seed(users, orders):
+    await common.reset_schema()
+    async with SessionLocal() as session:
+        await session.execute(insert(User), [
+            {'id': i, 'username': f'user{i}', 'email': f'user{i}@bench.test', 'is_staff': i == 1, 'is_active': True}
+            for i in range(1, users + 1)
+        ])
+        await session.execute(insert(Product), [{'id': 1, 'name': 'Bench plov', 'price': 30000}])
+        await session.execute(insert(Order), [
+            {'quantity': 1, 'user_id': i % users + 1, 'product_id': 1, 'unit_price': 30000, 'total_price': 30000}
+            for i in range(orders)
+        ])
+        await session.commit()
+
+
+class PoolWatch:
+    """Counts connections checked out of the engine's pool, and the most that were out at once."""
+
+    def __init__(self):
+        self.out = 0
+        self.peak = 0
+        self.checkouts = 0
+        self.connections = set()
+
+    def checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.out += 1
+        self.checkouts += 1
+        self.peak = max(self.peak, self.out)
+        self.connections.add(id(dbapi_connection))
+
+    def checkin(self, dbapi_connection, connection_record):
+        self.out -= 1
+
+
+async def fire(client, users, requests, concurrency):
+    """Sends the requests with at most concurrency in flight; returns (seconds, status counts)."""
+    headers = [common.access_headers(user_id, user_id == 1) for user_id in range(1, users + 1)]
+    statuses = collections.Counter()
+    remaining = iter(range(requests))
+
+    async def worker():
+        for i in remaining:
+            response = await client.get('/order/user/orders?limit=20', headers=headers[i % users])
+            statuses[response.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, statuses
+
+
+async def run(users, orders, requests, concurrency):
+    await seed(users, orders)
+    pool = engine.sync_engine.pool
+    watch = PoolWatch()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        # verifies every token once, so both runs below do the same work per request
+        await fire(client, users, users, 1)
+        serial_seconds, serial = await fire(client, users, requests, 1)
+        event.listen(pool, 'checkout', watch.checkout)
+        event.listen(pool, 'checkin', watch.checkin)
+        try:
+            parallel_seconds, parallel = await fire(client, users, requests, concurrency)
+        finally:
+            event.remove(pool, 'checkout', watch.checkout)
+            event.remove(pool, 'checkin', watch.checkin)
+    await engine.dispose()
+
+    print(f"pool {type(pool).__name__} size={pool.size() if hasattr(pool, 'size') else '-'}  "
+          f"database {engine.dialect.name}")
+    print(f"serial      {requests / serial_seconds:8.1f} req/s  {dict(serial)}")
+    print(f"parallel    {requests / parallel_seconds:8.1f} req/s  {dict(parallel)}  concurrency {concurrency}")
+    print(f"connections {watch.checkouts} checkouts of {len(watch.connections)} connections, "
+          f"at most {watch.peak} out at once")
+
+    failures = []
+    if set(serial) != {200} or set(parallel) != {200}:
+        failures.append("some requests failed")
+    if concurrency > 1 and watch.peak < 2:
+        failures.append("parallel requests never held more than one connection at a time")
+    return failures
+
+
+def main():
+    parser = common.add_database_arguments(
+        argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter))
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    try:
+        failures = asyncio.run(run(args.users, args.orders, args.requests, args.concurrency))
+    finally:
+        shutil.rmtree(DIRECTORY, ignore_errors=True)
+    for failure in failures:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Courier dispatch benchmark: grid matching against a brute-force distance matrix.
+
+Scatters orders and couriers over a city-sized box, then times the spatial
+grid + greedy matching used by dispatch ticks next to the same greedy
+matching over the full orders x couriers matrix, and reports how much longer
+the grid's routes are. It then times couriers and orders far outside the
+grid (a courier at 0,0, one courier far from the rest) and exits 1 if those
+take over a second or pick a different nearest courier than the matrix. With
+--db it also times a full tick (queries, UPDATE, commit) against --database,
+whose tables are dropped and reseeded.
+
+    python bench/dispatch.py --orders 10000 --couriers 1000 --db --database sqlite+aiosqlite:///./bench.db
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import common
+
+common.configure()
+
+import numpy as np
+from sqlalchemy import func, insert, select
+
+from database import SessionLocal, engine
+from dispatch import CourierGrid, assign, dispatch_orders, distances_km
+from models import Courier, Order, Product, User
+
+# roughly Tashkent
+BOX = ((41.20, 41.40), (69.15, 69.40))
+
+
+def scatter(rng, count):
+    return np.column_stack([rng.uniform(*BOX[0], count), rng.uniform(*BOX[1], count)])
+
+
+class FullMatrix:
+    """Stands in for CourierGrid: every courier is a candidate of every order."""
+
+    def __init__(self, positions):
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def nearest(self, points, k):
+        indexes, distances = [], []
+        for start in range(0, len(points), 1000):
+            matrix = distances_km(points[start:start + 1000], self.positions)
+            top = np.argsort(matrix, axis=1)[:, :k]
+            indexes.append(top)
+            distances.append(np.take_along_axis(matrix, top, axis=1))
+        return np.concatenate(indexes), np.concatenate(distances)
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, min(timings)
+
+
+def match(orders, couriers, repeat):
+    (grid_pairs, grid_ms) = timed(lambda: assign(orders, CourierGrid(np.arange(len(couriers)), couriers)), repeat)
+    (full_pairs, full_ms) = timed(lambda: assign(orders, FullMatrix(couriers)), repeat)
+    grid_km = sum(distance for _, _, distance in grid_pairs)
+    full_km = sum(distance for _, _, distance in full_pairs)
+    print(f"grid   {grid_ms:8.1f} ms  {len(grid_pairs)} assigned  {grid_km / len(grid_pairs):.3f} km avg")
+    print(f"matrix {full_ms:8.1f} ms  {len(full_pairs)} assigned  {full_km / len(full_pairs):.3f} km avg")
+    print(f"grid total distance {100 * (grid_km / full_km - 1):+.2f}% vs full matrix")
+
+
+def outliers(rng, orders):
+    """Returns failures for fleets with couriers far away from each other and from the orders."""
+    far = np.array([[0.0, 0.0], [-33.9, 18.4]])
+    fleets = {
+        'one courier at 0,0': far[:1],
+        'five couriers + one far': np.vstack([scatter(rng, 5), far[:1]]),
+        'city fleet, far orders': scatter(rng, 200),
+    }
+    points = np.vstack([orders, far])
+    failures = []
+    for name, couriers in fleets.items():
+        grid = CourierGrid(np.arange(len(couriers)), couriers)
+        (indexes, _), elapsed = timed(lambda: grid.nearest(points), 1)
+        expected = distances_km(points, couriers).argmin(axis=1)
+        print(f"{name:24} {elapsed:8.1f} ms")
+        if elapsed > 1000:
+            failures.append(f"{name}: nearest() took {elapsed:.0f} ms")
+        if not np.array_equal(indexes[:, 0], expected):
+            failures.append(f"{name}: nearest courier differs from the full matrix")
+    return failures
+
+
+async def tick(orders, couriers):
+    await common.reset_schema()
+    async with SessionLocal() as session:
+        await session.execute(insert(User), [{'id': 1, 'username': 'bench', 'email': 'bench@bench.test',
+                                              'is_staff': True, 'is_active': True}])
+        await session.execute(insert(Product), [{'id': 1, 'name': 'Bench plov', 'price': 30000}])
+        await session.execute(insert(Courier), [
+            {'id': i + 1, 'name': f'courier {i + 1}', 'is_active': True, 'lat': lat, 'lng': lng}
+            for i, (lat, lng) in enumerate(couriers.tolist())
+        ])
+        await session.execute(insert(Order), [
+            {'id': i + 1, 'quantity': 1, 'user_id': 1, 'product_id': 1, 'unit_price': 30000, 'total_price': 30000,
+             'pickup_lat': lat, 'pickup_lng': lng}
+            for i, (lat, lng) in enumerate(orders.tolist())
+        ])
+        await session.commit()
+
+    async with SessionLocal() as session:
+        stats = await dispatch_orders(session, batch_size=len(orders))
+        in_transit = await session.scalar(select(func.count()).select_from(Order)
+                                          .where(Order.order_statuses == 'IN_TRANSIT'))
+    await engine.dispose()
+    print(f"db tick {stats['total_ms']:8.1f} ms  (reads {stats['read_ms']} ms, matching {stats['match_ms']} ms)  "
+          f"{stats['assigned']} assigned, {in_transit} in transit")
+
+
+def main():
+    parser = common.add_database_arguments(
+        argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter))
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--couriers', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--db', action='store_true', help='also time a full tick against the database')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    orders, couriers = scatter(rng, args.orders), scatter(rng, args.couriers)
+    print(f"{args.orders} orders x {args.couriers} couriers")
+    match(orders, couriers, args.repeat)
+    failures = outliers(rng, orders)
+    if args.db:
+        asyncio.run(tick(orders, couriers))
+    for failure in failures:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Login latency under a burst of concurrent logins, plus how long a trivial
+request waits behind them (a blocked event loop shows up as a high probe p99).
+
+    python bench/login_latency.py --database sqlite+aiosqlite:///./bench.db --logins 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import common
+
+common.configure()
+
+import httpx
+
+from database import SessionLocal, engine
+from main import app
+from models import User
+from security import hash_password
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(name, samples):
+    print(f"{name}: n={len(samples)} p50={percentile(samples, 50) * 1000:.1f}ms "
+          f"p99={percentile(samples, 99) * 1000:.1f}ms mean={statistics.mean(samples) * 1000:.1f}ms")
+
+
+async def seed():
+    await common.reset_schema()
+    async with SessionLocal() as session:
+        session.add(User(username='bench', email='bench@example.com', password=await hash_password('bench'),
+                         is_staff=False, is_active=True))
+        await session.commit()
+
+
+async def main():
+    parser = common.add_database_arguments(argparse.ArgumentParser(description=__doc__))
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    await seed()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        login_samples, probe_samples = [], []
+        remaining = iter(range(args.logins))
+        done = asyncio.Event()
+
+        async def login_worker():
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.post('/auth/login', json={'username_or_email': 'bench', 'password': 'bench'})
+                response.raise_for_status()
+                login_samples.append(time.perf_counter() - started)
+
+        async def probe():
+            while not done.is_set():
+                started = time.perf_counter()
+                (await client.get('/')).raise_for_status()
+                probe_samples.append(time.perf_counter() - started)
+                await asyncio.sleep(0.005)
+
+        probe_task = asyncio.create_task(probe())
+        await asyncio.gather(*(login_worker() for _ in range(args.concurrency)))
+        done.set()
+        await probe_task
+
+    report('login', login_samples)
+    report('probe GET /', probe_samples)
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""Bytes on the wire and encode time for a large order listing, per response shape.
+
+Shapes: the default nested rows, a sparse fieldset, and the normalized view
+(products/users sent once). Each is measured raw, gzipped at the middleware's
+level, and brotli-compressed when the brotli module is installed.
+
+    python bench/payload.py --orders 10000 --repeat 5
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import orjson
+
+from compression import GZIP_LEVEL
+from fieldsets import parse_fields, shape_orders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def build_orders(orders, products=100, users=1000):
+    return [
+        {
+            "id": i,
+            "quantity": i % 5 + 1,
+            "order_statuses": "pending",
+            "product": {"id": i % products, "name": f"Product {i % products}", "price": 30000},
+            "unit_price": 30000,
+            "total_price": (i % 5 + 1) * 30000,
+            "version": 1,
+            "user": {"id": i % users, "username": f"user{i % users}", "email": f"user{i % users}@example.com"},
+        }
+        for i in range(orders)
+    ]
+
+
+def best_of(repeat, func, make_args):
+    timings = []
+    for _ in range(repeat):
+        args = make_args()
+        started = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def encode(orders, fields, normalized):
+    # same options as ORJSONResponse, which accepts the side tables' integer keys
+    return orjson.dumps(shape_orders(orders, None, fields, normalized), option=orjson.OPT_NON_STR_KEYS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--fields', default='quantity,order_statuses,total_price')
+    args = parser.parse_args()
+
+    shapes = {
+        'nested': (None, False),
+        f'fields={args.fields}': (parse_fields(args.fields), False),
+        'normalized': (None, True),
+    }
+    codecs = [('gzip', lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL))]
+    if brotli is not None:
+        codecs.append(('brotli', lambda body: brotli.compress(body, quality=4)))
+
+    for name, (fields, normalized) in shapes.items():
+        # shape_orders mutates the rows it normalizes, so every run gets fresh ones
+        seconds, body = best_of(args.repeat, encode, lambda: (build_orders(args.orders), fields, normalized))
+        line = f"{name:45} raw {len(body) / 1024:8.1f}KiB shape+encode {seconds * 1000:6.1f}ms"
+        for codec, compress in codecs:
+            compress_seconds, compressed = best_of(args.repeat, compress, lambda: (body,))
+            line += f" | {codec} {len(compressed) / 1024:7.1f}KiB in {compress_seconds * 1000:5.1f}ms"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
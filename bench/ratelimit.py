@@ -0,0 +1,69 @@
+"""Token bucket backends: per-call cost and cross-process accounting.
+
+Times take() on the in-memory and shared-memory backends, then has several
+processes drain one shared bucket at once. They must be granted exactly the
+burst plus whatever refilled during the run; the script exits 1 otherwise.
+
+    python bench/ratelimit.py --processes 4 --attempts 5000
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DATABASE_URL', 'sqlite+aiosqlite:///./bench.db')
+
+from ratelimit import MemoryBuckets, SharedMemoryBuckets
+
+
+def per_call(backend, calls, clients):
+    started = time.perf_counter()
+    for i in range(calls):
+        backend.take(f"* /order|ip:10.0.{i % clients}", 5.0, 300)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def drain(path, attempts, rate, burst, granted):
+    backend = SharedMemoryBuckets(path)
+    granted.put(sum(backend.take('POST /auth/login|ip:10.0.0.1', rate, burst)[0] for _ in range(attempts)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--clients', type=int, default=10000, help='distinct keys in the timing loop')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--attempts', type=int, default=5000, help='take() calls per process')
+    parser.add_argument('--rate', type=float, default=50.0, help='refill per second of the drained bucket')
+    parser.add_argument('--burst', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'buckets')
+        print(f"memory  {per_call(MemoryBuckets(), args.calls, args.clients):6.2f} us/take")
+        print(f"shm     {per_call(SharedMemoryBuckets(path), args.calls, args.clients):6.2f} us/take")
+
+        path = os.path.join(directory, 'drain')
+        granted = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=drain, args=(path, args.attempts, args.rate, args.burst, granted))
+                   for _ in range(args.processes)]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        total = sum(granted.get() for _ in workers)
+        elapsed = time.monotonic() - started
+        for worker in workers:
+            worker.join()
+
+    # refill can only have happened while the processes were running
+    ceiling = args.burst + args.rate * elapsed
+    print(f"{args.processes} processes x {args.attempts} attempts in {elapsed:.2f}s: "
+          f"{total} granted, at most {ceiling:.0f} allowed")
+    sys.exit(0 if args.burst <= total <= ceiling else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Read-replica routing check with SQLite files standing in for a primary and two replicas.
+
+Seeds the primary, copies it to both replicas ("replication"), then marks
+order 1 differently in each copy so every read shows where it was served
+from. Checks that reads spread over the replicas without filling the product
+cache, that a user's reads stay on the primary right after their own write,
+that a broken replica is skipped without errors and rejoins once it
+recovers. Exits 1 on any failure.
+
+    python bench/replicas.py --reads 40 --strategy least_connections
+"""
+import argparse
+import asyncio
+import collections
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+DIRECTORY = tempfile.mkdtemp(prefix='replicas-')
+PATHS = [os.path.join(DIRECTORY, name) for name in ('primary.db', 'replica-1.db', 'replica-2.db')]
+# the sqlite stand-ins need to be set before database.py creates the engines
+os.environ['DATABASE_URL'] = f'sqlite+aiosqlite:///{PATHS[0]}'
+os.environ['DATABASE_REPLICA_URLS'] = ','.join(f'sqlite+aiosqlite:///{path}' for path in PATHS[1:])
+os.environ.setdefault('DB_STICKY_SECONDS', '0.5')
+os.environ.setdefault('DB_REPLICA_CHECK_INTERVAL', '0')
+os.environ.setdefault('RATE_LIMIT_RULES', '')
+os.environ.setdefault('MAX_CONCURRENT_REQUESTS', '0')
+
+import httpx
+from sqlalchemy import insert
+
+from common import access_headers
+from database import Base, SessionLocal, engine, replicas
+from main import app
+from models import Order, Product, User
+from product_cache import product_cache
+
+# order 1's quantity tells which database answered
+SOURCES = {1: 'primary', 101: 'replica-1', 102: 'replica-2'}
+
+
+async def seed():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as session:
+        await session.execute(insert(User), [
+            {'id': 1, 'username': 'admin', 'email': 'admin@bench.test', 'is_staff': True, 'is_active': True},
+            {'id': 2, 'username': 'bob', 'email': 'bob@bench.test', 'is_staff': False, 'is_active': True},
+        ])
+        await session.execute(insert(Product), [{'id': 1, 'name': 'Bench plov', 'price': 30000}])
+        await session.execute(insert(Order), [{'id': 1, 'quantity': 1, 'user_id': 2, 'product_id': 1,
+                                               'unit_price': 30000, 'total_price': 30000}])
+        await session.commit()
+    await engine.dispose()
+    for quantity, path in zip((101, 102), PATHS[1:]):
+        replicate(path, quantity)
+
+
+def replicate(path, quantity):
+    shutil.copyfile(PATHS[0], path)
+    with sqlite3.connect(path) as connection:
+        connection.execute('UPDATE orders SET quantity = ? WHERE id = 1', (quantity,))
+
+
+async def break_replica(index):
+    # a directory where the file was: connecting fails, like a replica that is down
+    await replicas.replicas[index].engine.dispose()
+    os.remove(PATHS[index + 1])
+    os.mkdir(PATHS[index + 1])
+
+
+async def sources(client, reads, auth, path='/order/user/order/1'):
+    responses = await asyncio.gather(*(client.get(path, headers=auth) for _ in range(reads)))
+    counts = collections.Counter(SOURCES.get(response.json().get('quantity'), response.status_code)
+                                 for response in responses)
+    return counts
+
+
+async def run(reads):
+    failures = []
+    staff, bob = access_headers(1, True, 'admin'), access_headers(2, False, 'bob')
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        counts = await sources(client, reads, bob)
+        print(f"spread           {dict(counts)}")
+        if counts['primary'] or min(counts['replica-1'], counts['replica-2']) < reads // 4:
+            failures.append("reads did not spread over both replicas")
+        if await product_cache.get('id:1') is not None:
+            failures.append("the product cache was filled from a replica read")
+
+        created = await client.post('/order/make', json={'quantity': 3, 'product_id': 1}, headers=bob)
+        listed = await client.get('/order/user/orders', headers=bob)
+        own = [order['id'] for order in listed.json()['data']]
+        other = await sources(client, 4, staff, '/order/1')
+        print(f"after a write    own order listed: {created.json()['data']['id'] in own}, "
+              f"other user reads {dict(other)}")
+        if created.json()['data']['id'] not in own:
+            failures.append("the writer did not read their own write")
+        if other['primary']:
+            failures.append("another user's reads were pinned to the primary")
+        await asyncio.sleep(float(os.environ['DB_STICKY_SECONDS']))
+        after = await sources(client, 4, bob)
+        print(f"sticky expired   {dict(after)}")
+        if after['primary']:
+            failures.append("the writer stayed on the primary after the sticky window")
+
+        await break_replica(1)
+        counts = await sources(client, reads, staff, '/order/1')
+        print(f"replica-2 down   {dict(counts)}  healthy={[replica.healthy for replica in replicas.replicas]}")
+        if set(counts) != {'replica-1'}:
+            failures.append("reads were not moved off the broken replica cleanly")
+
+        os.rmdir(PATHS[2])
+        replicate(PATHS[2], 102)
+        counts = await sources(client, reads, staff, '/order/1')
+        print(f"replica-2 back   {dict(counts)}")
+        if not counts['replica-2']:
+            failures.append("the recovered replica did not rejoin")
+
+        await break_replica(0)
+        await break_replica(1)
+        counts = await sources(client, 4, staff, '/order/1')
+        print(f"all replicas out {dict(counts)}")
+        if set(counts) != {'primary'}:
+            failures.append("reads did not fall back to the primary")
+    return failures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reads', type=int, default=40)
+    parser.add_argument('--strategy', choices=('round_robin', 'least_connections'), default='round_robin')
+    args = parser.parse_args()
+
+    replicas.strategy = args.strategy
+    try:
+        await seed()
+        failures = await run(args.reads)
+    finally:
+        shutil.rmtree(DIRECTORY, ignore_errors=True)
+    for failure in failures:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""Response serialization paths for a page of orders.
+
+old:    hand-built dicts -> jsonable_encoder -> JSONResponse (json.dumps)
+model:  hand-built dicts -> OrderPage response model -> ORJSONResponse
+direct: hand-built dicts -> ORJSONResponse, what the listings return now
+
+The page is validated against OrderPage first, so the fixture can't drift
+from the schema it stands in for.
+
+    python bench/serialization.py --orders 10000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from schemas import OrderPage
+
+
+def build_page(orders):
+    data = [
+        {
+            "id": i,
+            "quantity": i % 5 + 1,
+            "order_statuses": "pending",
+            "product": {"id": i % 100, "name": f"Product {i % 100}", "price": 30000},
+            "unit_price": 30000,
+            "total_price": (i % 5 + 1) * 30000,
+            "version": 1,
+            "user": {"id": i % 1000, "username": f"user{i % 1000}", "email": f"user{i % 1000}@example.com"},
+        }
+        for i in range(orders)
+    ]
+    return {"data": data, "next_cursor": None}
+
+
+def old_path(page):
+    return JSONResponse(jsonable_encoder(page)).body
+
+
+if hasattr(OrderPage, 'model_validate'):
+    validate = OrderPage.model_validate
+
+    def model_path(page):
+        return ORJSONResponse(OrderPage.model_validate(page).model_dump(mode='json')).body
+else:
+    validate = OrderPage.parse_obj
+
+    # pydantic v1: FastAPI still runs jsonable_encoder over the validated model
+    def model_path(page):
+        return ORJSONResponse(jsonable_encoder(OrderPage.parse_obj(page))).body
+
+
+def direct_path(page):
+    return ORJSONResponse(page).body
+
+
+def measure(func, page, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = func(page)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    func(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    page = build_page(args.orders)
+    validate(page)
+    for name, func in (('old', old_path), ('model', model_path), ('direct', direct_path)):
+        best, peak, size = measure(func, page, args.repeat)
+        print(f"{name:6}: {best * 1000:.1f}ms best of {args.repeat}, peak {peak / 2 ** 20:.1f}MiB, "
+              f"{size / 2 ** 20:.2f}MiB body")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Statement-count regression check for the order listings.
+
+Seeds N orders for one user and N more spread over N other users, every
+order on its own product, then counts the statements (after_cursor_execute
+events) a listing request runs, with the product cache cold and warm. A
+listing that loads products or users per row runs more statements at a
+larger N; the script exits 1 unless every count matches across all N.
+
+    python bench/statements.py --sizes 1,100
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+
+import common
+
+DIRECTORY = tempfile.mkdtemp(prefix='statements-')
+common.configure(default=f"sqlite+aiosqlite:///{os.path.join(DIRECTORY, 'statements.db')}")
+# a sync that happens to fall inside a measured request would add a statement
+os.environ.setdefault('DENYLIST_SYNC_INTERVAL', '3600')
+
+import httpx
+from sqlalchemy import event, insert
+
+from database import SessionLocal, engine
+from main import app
+from models import Order, Product, User
+from product_cache import invalidate_all_products
+
+PATHS = ('/order/list?limit={limit}', '/order/user/orders?limit={limit}')
+
+
+async def seed(orders):
+    """User 1 is staff, user 2 owns the first N orders, users 3.. one order each."""
+    await common.reset_schema()
+    async with SessionLocal() as session:
+        await session.execute(insert(User), [
+            {'id': i, 'username': f'user{i}', 'email': f'user{i}@bench.test', 'is_staff': i == 1, 'is_active': True}
+            for i in range(1, orders + 3)
+        ])
+        await session.execute(insert(Product), [
+            {'id': i, 'name': f'product {i}', 'price': 1000 * i} for i in range(1, 2 * orders + 1)
+        ])
+        await session.execute(insert(Order), [
+            {'quantity': 1, 'user_id': 2 if i <= orders else i - orders + 2, 'product_id': i,
+             'unit_price': 1000 * i, 'total_price': 1000 * i}
+            for i in range(1, 2 * orders + 1)
+        ])
+        await session.commit()
+    await invalidate_all_products()
+
+
+async def count_statements(client, path, headers, expected_rows):
+    statements = 0
+
+    def after_cursor_execute(*args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(engine.sync_engine, 'after_cursor_execute', after_cursor_execute)
+    try:
+        response = await client.get(path, headers=headers)
+    finally:
+        event.remove(engine.sync_engine, 'after_cursor_execute', after_cursor_execute)
+    response.raise_for_status()
+    rows = len(response.json()['data'])
+    if rows != expected_rows:
+        raise AssertionError(f"{path} returned {rows} orders, expected {expected_rows}")
+    return statements
+
+
+async def measure(orders):
+    """{(path, cache): statements} for one seeded size."""
+    await seed(orders)
+    counts = {}
+    staff, owner = common.access_headers(1, True), common.access_headers(2, False)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for template, headers, expected_rows in ((PATHS[0], staff, 2 * orders), (PATHS[1], owner, orders)):
+            path = template.format(limit=2 * orders)
+            # the first request verifies the token and syncs the denylist; those are per-client, not per-row
+            await client.get(path, headers=headers)
+            await invalidate_all_products()
+            counts[template, 'cold'] = await count_statements(client, path, headers, expected_rows)
+            counts[template, 'warm'] = await count_statements(client, path, headers, expected_rows)
+    return counts
+
+
+async def run(sizes):
+    results = {orders: await measure(orders) for orders in sizes}
+    await engine.dispose()
+    failures = []
+    for key in results[sizes[0]]:
+        counts = [results[orders][key] for orders in sizes]
+        path, cache = key
+        print(f"{path.split('?')[0]:20} {cache:4}  " + "  ".join(f"N={orders}: {count}"
+                                                              for orders, count in zip(sizes, counts)))
+        if len(set(counts)) > 1:
+            failures.append(f"{path.split('?')[0]} ({cache} cache) runs more statements as N grows: {counts}")
+    return failures
+
+
+def main():
+    parser = common.add_database_arguments(
+        argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter))
+    parser.add_argument('--sizes', default='1,100', help='comma-separated N; 2N must fit in one page')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    try:
+        failures = asyncio.run(run(sizes))
+    finally:
+        shutil.rmtree(DIRECTORY, ignore_errors=True)
+    for failure in failures:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
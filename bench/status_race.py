@@ -0,0 +1,92 @@
+"""Concurrent-update stress for order status transitions.
+
+Many clients race to move the same orders along PENDING -> IN_TRANSIT -> DELIVERED,
+half of them pinning the version they last read. The run checks that every
+order's version equals one plus its successful transitions (no lost or double
+updates), that losers got 409 rather than an error, and exits 1 otherwise.
+
+    python bench/status_race.py --database sqlite+aiosqlite:///./bench.db --orders 50 --writers 20
+"""
+import argparse
+import asyncio
+import collections
+import random
+import sys
+
+import common
+
+common.configure()
+
+import httpx
+from sqlalchemy import insert, select
+
+from database import SessionLocal, engine
+from main import app
+from models import Order, Product, User
+
+
+async def seed(orders):
+    await common.reset_schema()
+    async with SessionLocal() as session:
+        await session.execute(insert(User), [{'id': 1, 'username': 'courier', 'email': 'courier@bench.test',
+                                              'is_staff': True, 'is_active': True}])
+        await session.execute(insert(Product), [{'id': 1, 'name': 'Bench plov', 'price': 30000}])
+        await session.execute(insert(Order), [
+            {'id': i, 'quantity': 1, 'user_id': 1, 'product_id': 1, 'unit_price': 30000, 'total_price': 30000}
+            for i in range(1, orders + 1)
+        ])
+        await session.commit()
+
+
+async def race(orders, writers, rounds):
+    headers = common.access_headers(1, True, 'courier')
+    outcomes = collections.Counter()
+    successes = collections.Counter()
+    rng = random.Random(7)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def writer():
+            for _ in range(rounds):
+                order_id = rng.randint(1, orders)
+                body = {'order_statuses': rng.choice(('IN_TRANSIT', 'DELIVERED'))}
+                if rng.random() < 0.5:
+                    read = await client.get(f'/order/{order_id}', headers=headers)
+                    body['version'] = read.json()['version']
+                response = await client.patch(f'/order/{order_id}/update-status', json=body, headers=headers)
+                outcomes[response.status_code] += 1
+                if response.status_code == 200:
+                    successes[order_id] += 1
+
+        await asyncio.gather(*(writer() for _ in range(writers)))
+    return outcomes, successes
+
+
+async def main():
+    parser = common.add_database_arguments(
+        argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter))
+    parser.add_argument('--orders', type=int, default=50)
+    parser.add_argument('--writers', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=25, help='attempts per writer')
+    args = parser.parse_args()
+
+    await seed(args.orders)
+    outcomes, successes = await race(args.orders, args.writers, args.rounds)
+    async with SessionLocal() as session:
+        rows = (await session.execute(select(Order.id, Order.order_statuses, Order.version))).all()
+    await engine.dispose()
+
+    failures = [f"{row.id}: version {row.version} after {successes[row.id]} transitions"
+                for row in rows if row.version != 1 + successes[row.id] or successes[row.id] > 2]
+    unexpected = {code: count for code, count in outcomes.items() if code not in (200, 409)}
+    print(f"responses: {dict(outcomes)}")
+    print(f"final statuses: {dict(collections.Counter(row.order_statuses.code for row in rows))}")
+    for failure in failures:
+        print(f"LOST UPDATE {failure}")
+    if unexpected:
+        print(f"UNEXPECTED {unexpected}")
+    sys.exit(1 if failures or unexpected else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
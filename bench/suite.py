@@ -0,0 +1,179 @@
+"""Seeded load-test suite: drives the real app through httpx's ASGI transport and
+writes per-scenario throughput and p50/p95/p99 latency to a JSON baseline.
+
+    python bench/suite.py --database sqlite+aiosqlite:///./bench.db --users 200 --products 50 --orders 20000 --out bench/current.json
+    python bench/suite.py --database sqlite+aiosqlite:///./bench.db --compare bench/baseline.json --out bench/current.json
+
+With --compare the run exits 1 when any scenario's p95 grows or its throughput
+drops by more than --tolerance (a fraction, 0.25 by default) against the baseline.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+
+import common
+
+common.configure()
+
+import httpx
+from sqlalchemy import insert
+
+from database import SessionLocal, engine
+from main import app
+from models import Order, Product, User
+from security import hash_password
+
+PASSWORD = 'bench-password'
+SCENARIOS = ('login', 'order_create', 'admin_list', 'user_history')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def seed(users, products, orders, seed_value):
+    """Recreates the schema and bulk-inserts the requested volumes; user 1 is staff."""
+    rng = random.Random(seed_value)
+    await common.reset_schema()
+
+    # one hash shared by every user keeps seeding fast; logins still verify it in full
+    password = await hash_password(PASSWORD)
+    async with SessionLocal() as session:
+        await session.execute(insert(User), [
+            {'id': i, 'username': f'user{i}', 'email': f'user{i}@bench.test', 'password': password,
+             'is_staff': i == 1, 'is_active': True}
+            for i in range(1, users + 1)
+        ])
+        prices = {i: rng.randrange(5000, 100000, 500) for i in range(1, products + 1)}
+        await session.execute(insert(Product), [
+            {'id': i, 'name': f'product {i}', 'price': price} for i, price in prices.items()
+        ])
+        for start in range(0, orders, 5000):
+            batch = []
+            for _ in range(start, min(orders, start + 5000)):
+                product_id, quantity = rng.randint(1, products), rng.randint(1, 5)
+                batch.append({'quantity': quantity, 'user_id': rng.randint(1, users), 'product_id': product_id,
+                              'order_statuses': rng.choice(('PENDING', 'IN_TRANSIT', 'DELIVERED')),
+                              'unit_price': prices[product_id], 'total_price': quantity * prices[product_id]})
+            await session.execute(insert(Order), batch)
+        await session.commit()
+
+
+def scenario_requests(name, args, rng):
+    """Yields (method, path, kwargs) for one scenario, forever."""
+    staff = common.access_headers(1, True)
+    user_headers = [common.access_headers(user_id, False) for user_id in range(2, min(args.users, 51) + 1)] or [staff]
+    while True:
+        if name == 'login':
+            user_id = rng.randint(1, args.users)
+            yield 'POST', '/auth/login', {'json': {'username_or_email': f'user{user_id}', 'password': PASSWORD}}
+        elif name == 'order_create':
+            yield 'POST', '/order/make', {'json': {'quantity': rng.randint(1, 5),
+                                                   'product_id': rng.randint(1, args.products)},
+                                          'headers': rng.choice(user_headers)}
+        elif name == 'admin_list':
+            status = rng.choice((None, 'PENDING', 'IN_TRANSIT', 'DELIVERED'))
+            query = f'&order_statuses={status}' if status else ''
+            yield 'GET', f'/order/list?limit=50{query}', {'headers': staff}
+        elif name == 'user_history':
+            yield 'GET', '/order/user/orders?limit=50', {'headers': rng.choice(user_headers)}
+
+
+async def run_scenario(client, name, requests, concurrency, args, rng):
+    planned = itertools.islice(scenario_requests(name, args, rng), requests)
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for method, path, kwargs in planned:
+            started = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': concurrency,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def compare(baseline, current, tolerance):
+    """Returns one line per scenario that regressed beyond the tolerance."""
+    regressions = []
+    for name, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+        if result['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s")
+        if result['errors'] > before['errors']:
+            regressions.append(f"{name}: errors {before['errors']} -> {result['errors']}")
+    return regressions
+
+
+async def main():
+    parser = common.add_database_arguments(
+        argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter))
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--products', type=int, default=50)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario')
+    parser.add_argument('--login-requests', type=int, default=100, help='logins are CPU-bound hashing')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=20, help='unrecorded requests before each scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default='bench/current.json')
+    parser.add_argument('--compare', help='baseline JSON to diff against')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    await seed(args.users, args.products, args.orders, args.seed)
+    rng = random.Random(args.seed)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for name in args.scenarios.split(','):
+            requests = args.login_requests if name == 'login' else args.requests
+            await run_scenario(client, name, args.warmup, args.concurrency, args, rng)
+            results[name] = await run_scenario(client, name, requests, args.concurrency, args, rng)
+            print(f"{name:13} {results[name]['throughput_rps']:8.1f} req/s  p50={results[name]['p50_ms']}ms "
+                  f"p95={results[name]['p95_ms']}ms p99={results[name]['p99_ms']}ms errors={results[name]['errors']}")
+    await engine.dispose()
+
+    current = {
+        'config': {key: getattr(args, key) for key in ('users', 'products', 'orders', 'requests',
+                                                        'login_requests', 'concurrency', 'seed')},
+        'environment': {'python': platform.python_version(), 'database': engine.dialect.name},
+        'scenarios': results,
+    }
+    with open(args.out, 'w') as out:
+        json.dump(current, out, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(json.load(baseline_file), current, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""Requests/second a single event loop (one uvicorn worker) sustains on DB-bound routes.
+
+    python bench/throughput.py --database sqlite+aiosqlite:///./bench.db --orders 2000 --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+
+import common
+
+common.configure()
+
+import httpx
+
+from database import SessionLocal, engine
+from main import app
+from models import Order, Product, User
+from werkzeug.security import generate_password_hash
+
+
+async def seed(orders):
+    await common.reset_schema()
+
+    async with SessionLocal() as session:
+        user = User(username='bench', email='bench@example.com', password=generate_password_hash('bench'),
+                    is_staff=True, is_active=True)
+        product = Product(name='Bench plov', price=30000)
+        session.add_all([user, product])
+        await session.flush()
+        session.add_all([
+            Order(quantity=i % 5 + 1, user_id=user.id, product_id=product.id)
+            for i in range(orders)
+        ])
+        await session.commit()
+
+
+async def run(path, requests, concurrency):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        response = await client.post('/auth/login', json={'username_or_email': 'bench', 'password': 'bench'})
+        headers = {'Authorization': f"Bearer {response.json()['data']['access']}"}
+
+        remaining = iter(range(requests))
+
+        async def worker():
+            for _ in remaining:
+                response = await client.get(path, headers=headers)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return requests / (time.perf_counter() - started)
+
+
+async def main():
+    parser = common.add_database_arguments(argparse.ArgumentParser(description=__doc__))
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--path', default='/order/list?limit=50')
+    args = parser.parse_args()
+
+    await seed(args.orders)
+    throughput = await run(args.path, args.requests, args.concurrency)
+    print(f"{args.path}: {throughput:.1f} req/s at concurrency {args.concurrency}")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Small in-process LRU cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LoopLocal:
+    """One factory() result per running event loop.
+
+    asyncio queues, locks and semaphores belong to the loop they were first
+    used on; test clients may run each request on a new one.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._loop = None
+
+    def get(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._value, self._loop = self.factory(), loop
+        return self._value
+
+
+class MemoryBackend:
+    """Async facade over TTLCache so it can stand in for a shared backend."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key):
+        return self._cache.get(key)
+
+    async def get_many(self, keys):
+        return [self._cache.get(key) for key in keys]
+
+    async def set(self, key, value):
+        self._cache.set(key, value)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._cache.delete(key)
+
+    async def clear(self):
+        self._cache.clear()
+
+
+class RedisBackend:
+    """Stores JSON values in a redis.asyncio (or fakeredis.aioredis) client."""
+
+    def __init__(self, client, prefix, ttl=60):
+        self._client = client
+        self._prefix = prefix
+        self.ttl = ttl
+
+    async def get(self, key):
+        value = await self._client.get(self._prefix + key)
+        return None if value is None else json.loads(value)
+
+    async def get_many(self, keys):
+        if not keys:
+            return []
+        values = await self._client.mget([self._prefix + key for key in keys])
+        return [None if value is None else json.loads(value) for value in values]
+
+    async def set(self, key, value):
+        await self._client.set(self._prefix + key, json.dumps(value), ex=self.ttl)
+
+    async def delete(self, *keys):
+        if keys:
+            await self._client.delete(*(self._prefix + key for key in keys))
+
+    async def clear(self):
+        keys = [key async for key in self._client.scan_iter(match=self._prefix + '*')]
+        if keys:
+            await self._client.delete(*keys)
+
+
+def cache_backend(url, prefix, maxsize=1024, ttl=60):
+    """memory:// (default), redis://host:port/db, or fakeredis:// for a local stand-in."""
+    if url.startswith('memory://'):
+        return MemoryBackend(maxsize=maxsize, ttl=ttl)
+    if url.startswith('fakeredis://'):
+        from fakeredis import aioredis as fakeredis
+        return RedisBackend(fakeredis.FakeRedis(), prefix, ttl=ttl)
+    if url.startswith(('redis://', 'rediss://')):
+        import redis.asyncio as redis
+        return RedisBackend(redis.from_url(url), prefix, ttl=ttl)
+    raise ValueError(f"Unsupported cache backend: {url}")
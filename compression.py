@@ -0,0 +1,30 @@
+import os
+
+from fastapi.middleware.gzip import GZipMiddleware
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # optional; GZip covers every client anyway
+    BrotliMiddleware = None
+
+# responses smaller than this go out uncompressed; the framing would cost more than it saves
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1000'))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+# Server-Sent Events must reach the client per event; the compressors only flush at the end
+UNCOMPRESSED_PATHS = ('/order/events',)
+
+
+class CompressionMiddleware:
+    """Brotli when brotli-asgi is installed (falling back to gzip per client), else gzip."""
+
+    def __init__(self, app):
+        self.app = app
+        if BrotliMiddleware is not None:
+            self.compressed = BrotliMiddleware(app, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True)
+        else:
+            self.compressed = GZipMiddleware(app, minimum_size=COMPRESSION_MIN_SIZE, compresslevel=GZIP_LEVEL)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith(UNCOMPRESSED_PATHS):
+            return await self.app(scope, receive, send)
+        await self.compressed(scope, receive, send)
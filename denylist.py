@@ -0,0 +1,104 @@
+import datetime
+import hashlib
+import math
+import os
+import time
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+
+from models import RevokedToken
+
+DENYLIST_CAPACITY = int(os.getenv('DENYLIST_CAPACITY', '100000'))
+DENYLIST_ERROR_RATE = float(os.getenv('DENYLIST_ERROR_RATE', '0.001'))
+# how often a worker picks up revocations made by other workers
+DENYLIST_SYNC_INTERVAL = float(os.getenv('DENYLIST_SYNC_INTERVAL', '10'))
+
+
+class BloomFilter:
+    """Fixed-size bloom filter; no false negatives, false positives near error_rate at capacity."""
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class Denylist:
+    """Revoked jtis: a bloom filter in front of an in-memory map, mirrored from revoked_tokens.
+
+    Lookups never touch the database; sync() pulls new rows at most every
+    sync_interval seconds, by id, so it stays one small query per worker.
+    """
+
+    def __init__(self, capacity=DENYLIST_CAPACITY, error_rate=DENYLIST_ERROR_RATE,
+                 sync_interval=DENYLIST_SYNC_INTERVAL):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._expires = {}
+        self._last_id = 0
+        self._synced_at = None
+
+    def add(self, jti, expires_at):
+        self._expires[jti] = expires_at
+        self._bloom.add(jti)
+
+    def __contains__(self, jti):
+        if jti not in self._bloom:
+            return False
+        expires_at = self._expires.get(jti)
+        return expires_at is not None and expires_at > time.time()
+
+    def _prune(self):
+        now = time.time()
+        self._expires = {jti: expires_at for jti, expires_at in self._expires.items() if expires_at > now}
+        # bloom filters can't forget, so start a fresh one from what is still live
+        self._bloom = BloomFilter(max(self.capacity, len(self._expires)), self.error_rate)
+        for jti in self._expires:
+            self._bloom.add(jti)
+
+    async def sync(self, session, force=False):
+        now = time.monotonic()
+        if not force and self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        rows = await session.execute(
+            select(RevokedToken.id, RevokedToken.jti, RevokedToken.expires_at)
+            .where(RevokedToken.id > self._last_id).order_by(RevokedToken.id)
+        )
+        for row in rows:
+            self.add(row.jti, row.expires_at.replace(tzinfo=datetime.timezone.utc).timestamp())
+            self._last_id = row.id
+        if len(self._expires) > self.capacity:
+            self._prune()
+
+    async def revoke(self, session, jti, expires_at):
+        """Records a revocation for every worker; expires_at is the token's exp (epoch seconds)."""
+        if jti in self:
+            return
+        expires = datetime.datetime.fromtimestamp(expires_at, datetime.timezone.utc).replace(tzinfo=None)
+        await session.execute(delete(RevokedToken).where(RevokedToken.expires_at < datetime.datetime.utcnow()))
+        session.add(RevokedToken(jti=jti, expires_at=expires))
+        try:
+            await session.commit()
+        except IntegrityError:
+            # revoked concurrently by another request
+            await session.rollback()
+        self.add(jti, expires_at)
+
+
+denylist = Denylist()
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import time
+from dataclasses import dataclass
+
+from fastapi import Depends, Request, status
+from fastapi.exceptions import HTTPException
+from fastapi_jwt_auth import AuthJWT
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import TTLCache
+from database import get_db
+from denylist import denylist
+from metrics import observe_stage
+from models import User
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '60'))
+
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', '300'))
+
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# sha256(token) -> VerifiedToken, so repeat requests skip signature and claims checks
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    id: int
+    username: str
+    is_staff: bool
+
+
+@dataclass(frozen=True)
+class VerifiedToken:
+    user: CurrentUser
+    jti: str
+    expires_at: float
+
+
+def user_claims(user):
+    """Claims embedded in access tokens so role checks need no lookup."""
+    return {'user_id': user.id, 'is_staff': bool(user.is_staff)}
+
+
+def invalidate_user(username):
+    user_cache.delete(username)
+
+
+def bearer_token(request):
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return token if scheme.lower() == 'bearer' and token else None
+
+
+def token_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def claims_user(claims, session):
+    username = claims['sub']
+    if 'user_id' in claims and 'is_staff' in claims:
+        return CurrentUser(id=claims['user_id'], username=username, is_staff=claims['is_staff'])
+
+    # Tokens minted before claims were embedded fall back to a cached lookup
+    current_user = user_cache.get(username)
+    if current_user is None:
+        with observe_stage('user_lookup'):
+            db_user = await session.scalar(select(User).where(User.username == username))
+        if db_user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        current_user = CurrentUser(id=db_user.id, username=db_user.username, is_staff=bool(db_user.is_staff))
+        user_cache.set(username, current_user)
+    return current_user
+
+
+async def get_verified_token(request: Request, Authorize: AuthJWT = Depends(),
+                             session: AsyncSession = Depends(get_db)):
+    token = bearer_token(request)
+    key = token_key(token) if token else None
+    verified = token_cache.get(key) if key else None
+    if verified is None:
+        try:
+            with observe_stage('jwt'):
+                Authorize.jwt_required()
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
+
+        claims = Authorize.get_raw_jwt()
+        verified = VerifiedToken(user=await claims_user(claims, session), jti=claims.get('jti'),
+                                 expires_at=claims.get('exp', time.time() + TOKEN_CACHE_TTL))
+        if key:
+            # never outlive the token itself
+            token_cache.set(key, verified, ttl=min(TOKEN_CACHE_TTL, verified.expires_at - time.time()))
+    elif verified.expires_at <= time.time():
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
+
+    await denylist.sync(session)
+    if verified.jti in denylist:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has been revoked")
+    # lets database routing keep this user's reads on the primary right after they write
+    request.state.user_id = verified.user.id
+    return verified
+
+
+async def get_current_user(verified: VerifiedToken = Depends(get_verified_token)):
+    return verified.user
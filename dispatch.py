@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import bindparam, exists, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from cache import LoopLocal
+from events import event_bus
+from models import Courier, Order
+
+# seconds between dispatch ticks; off by default, set it on exactly one worker
+# (ticks on several workers would race for the same couriers)
+DISPATCH_INTERVAL = float(os.getenv('DISPATCH_INTERVAL', '0'))
+# pending orders considered per tick, oldest first
+DISPATCH_BATCH_SIZE = int(os.getenv('DISPATCH_BATCH_SIZE', '10000'))
+# grid cell edge in degrees (~2 km of latitude)
+DISPATCH_CELL_DEGREES = float(os.getenv('DISPATCH_CELL_DEGREES', '0.02'))
+# nearest couriers kept per order, so a taken courier falls through to the next one
+DISPATCH_CANDIDATES = int(os.getenv('DISPATCH_CANDIDATES', '8'))
+KM_PER_DEGREE = 111.32
+
+logger = logging.getLogger('delivery.dispatch')
+
+
+def distances_km(points, couriers):
+    """(m, 2) x (n, 2) lat/lng arrays -> (m, n) equirectangular distances, good enough within a city."""
+    lat1, lng1 = points[:, 0, None], points[:, 1, None]
+    lat2, lng2 = couriers[None, :, 0], couriers[None, :, 1]
+    x = (lng2 - lng1) * np.cos(np.radians((lat1 + lat2) / 2))
+    y = lat2 - lat1
+    return KM_PER_DEGREE * np.sqrt(x * x + y * y)
+
+
+class CourierGrid:
+    """Uniform grid over courier positions; nearest() only measures couriers in nearby cells."""
+
+    def __init__(self, ids, positions, cell=DISPATCH_CELL_DEGREES):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.cell = cell
+        cells = defaultdict(list)
+        for index, key in enumerate(map(tuple, self._cell_of(self.positions))):
+            cells[key].append(index)
+        self._cells = {key: np.array(indexes, dtype=np.int64) for key, indexes in cells.items()}
+        # bounding box of the occupied cells
+        occupied = np.array(list(self._cells) or [(0, 0)], dtype=np.int64)
+        self._low, self._high = occupied.min(axis=0), occupied.max(axis=0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell_of(self, points):
+        return np.floor(points / self.cell).astype(np.int64)
+
+    def _covers(self, cell_lat, cell_lng, radius):
+        return (cell_lat - radius <= self._low[0] and cell_lat + radius >= self._high[0]
+                and cell_lng - radius <= self._low[1] and cell_lng + radius >= self._high[1])
+
+    def _around(self, cell_lat, cell_lng, minimum):
+        # grow the square of cells until it holds enough couriers, then one ring more,
+        # since a courier just outside the square can be closer than one in its corner.
+        # Every courier is a candidate once the square would cover all of them or hold more
+        # cells than there are couriers, so a point far from the grid costs O(couriers), not O(distance)
+        everyone = np.arange(len(self))
+        if minimum >= len(self):
+            return everyone
+        radius, found = 0, 0
+        while True:
+            if (2 * radius + 3) ** 2 > len(self) or self._covers(cell_lat, cell_lng, radius + 1):
+                return everyone
+            found = sum(len(self._cells.get((cell_lat + i, cell_lng + j), ()))
+                        for i in range(-radius, radius + 1) for j in range(-radius, radius + 1)
+                        if max(abs(i), abs(j)) == radius) + found
+            if found >= minimum:
+                break
+            radius += 1
+        radius += 1
+        indexes = [self._cells[key] for i in range(-radius, radius + 1) for j in range(-radius, radius + 1)
+                   if (key := (cell_lat + i, cell_lng + j)) in self._cells]
+        return np.concatenate(indexes)
+
+    def nearest(self, points, k=DISPATCH_CANDIDATES):
+        """Returns (courier indexes, distances), both (m, k) and nearest first; short rows pad with -1/inf."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        k = min(k, len(self))
+        indexes = np.full((len(points), k), -1, dtype=np.int64)
+        distances = np.full((len(points), k), np.inf)
+        if not k:
+            return indexes, distances
+
+        # orders in the same cell share one candidate set and one distance matrix
+        point_cells = self._cell_of(points)
+        keys, groups = np.unique(point_cells, axis=0, return_inverse=True)
+        groups = groups.reshape(-1)
+        for group, (cell_lat, cell_lng) in enumerate(keys):
+            members = np.flatnonzero(groups == group)
+            candidates = self._around(int(cell_lat), int(cell_lng), k)
+            matrix = distances_km(points[members], self.positions[candidates])
+            if len(candidates) > k:
+                top = np.argpartition(matrix, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(len(candidates)), (len(members), len(candidates)))
+            top_distances = np.take_along_axis(matrix, top, axis=1)
+            order = np.argsort(top_distances, axis=1)
+            indexes[members, :len(candidates)] = candidates[np.take_along_axis(top, order, axis=1)]
+            distances[members, :len(candidates)] = np.take_along_axis(top_distances, order, axis=1)
+        return indexes, distances
+
+
+def assign(points, grid, k=DISPATCH_CANDIDATES):
+    """Greedy nearest-first matching, one order per courier.
+
+    Every (order, candidate courier) pair is sorted by distance and taken while
+    both sides are free. Returns (order index, courier index, km) triples;
+    orders whose candidates all went to closer orders wait for the next tick.
+    """
+    indexes, distances = grid.nearest(points, k)
+    flat = np.argsort(distances, axis=None, kind='stable')
+    flat = flat[np.isfinite(distances.ravel()[flat])]
+    order_indexes, ranks = np.divmod(flat, indexes.shape[1])
+    courier_indexes = indexes[order_indexes, ranks]
+
+    assigned = []
+    orders_taken = np.zeros(len(indexes), dtype=bool)
+    couriers_taken = np.zeros(len(grid), dtype=bool)
+    for order_index, courier_index, position in zip(order_indexes.tolist(), courier_indexes.tolist(), flat.tolist()):
+        if orders_taken[order_index] or couriers_taken[courier_index]:
+            continue
+        orders_taken[order_index] = couriers_taken[courier_index] = True
+        assigned.append((order_index, courier_index, float(distances.flat[position])))
+        if len(assigned) == len(grid):
+            break
+    return assigned
+
+
+def match_orders(courier_ids, courier_positions, points):
+    """Grid + assign(); returns (order index, courier id, km). CPU-bound, so ticks run it in a thread."""
+    grid = CourierGrid(courier_ids, courier_positions)
+    return [(order_index, int(grid.ids[courier_index]), distance)
+            for order_index, courier_index, distance in assign(points, grid)]
+
+
+async def available_couriers(session):
+    busy = select(Order.courier_id).where(Order.order_statuses == 'IN_TRANSIT', Order.courier_id.is_not(None))
+    return (await session.execute(
+        select(Courier.id, Courier.lat, Courier.lng)
+        .where(Courier.is_active.is_(True), Courier.lat.is_not(None), Courier.lng.is_not(None),
+               Courier.id.not_in(busy))
+    )).all()
+
+
+async def dispatch_orders(session, batch_size=DISPATCH_BATCH_SIZE):
+    """One dispatch tick: assigns pending orders to the nearest free couriers.
+
+    An assigned order moves to IN_TRANSIT with its courier in one conditional
+    UPDATE per row, so orders changed since they were read, and couriers that
+    took another order meanwhile, are left alone. A tick running at the same
+    time can't see the other's uncommitted claims; the partial unique index
+    on in-transit couriers refuses the second one, and this tick then writes
+    row by row, skipping the couriers taken. Commits, publishes the status
+    changes and returns the tick's stats.
+    """
+    started = time.perf_counter()
+    couriers = await available_couriers(session)
+    orders = (await session.execute(
+        select(Order.id, Order.user_id, Order.pickup_lat, Order.pickup_lng)
+        .where(Order.order_statuses == 'PENDING', Order.courier_id.is_(None),
+               Order.pickup_lat.is_not(None), Order.pickup_lng.is_not(None))
+        .order_by(Order.id).limit(batch_size)
+    )).all()
+    read = time.perf_counter()
+
+    planned = []
+    if orders and couriers:
+        points = np.array([(row.pickup_lat, row.pickup_lng) for row in orders], dtype=np.float64)
+        # off the event loop: a large batch takes long enough to stall every other request
+        matches = await asyncio.to_thread(match_orders, [row.id for row in couriers],
+                                          [(row.lat, row.lng) for row in couriers], points)
+        planned = [(orders[order_index], courier_id, distance) for order_index, courier_id, distance in matches]
+    matched = time.perf_counter()
+
+    assignments = []
+    if planned:
+        orders_table = Order.__table__
+        busy = orders_table.alias('busy')
+        statement = (update(orders_table)
+                     .where(orders_table.c.id == bindparam('order_id'),
+                            orders_table.c.order_statuses == 'PENDING',
+                            orders_table.c.courier_id.is_(None),
+                            ~exists().where(busy.c.courier_id == bindparam('courier'),
+                                            busy.c.order_statuses == 'IN_TRANSIT'))
+                     .values(courier_id=bindparam('courier'), order_statuses='IN_TRANSIT',
+                             version=orders_table.c.version + 1, assigned_at=func.now()))
+        rows = [{'order_id': row.id, 'courier': courier_id} for row, courier_id, _ in planned]
+        try:
+            await session.execute(statement, rows)
+        except IntegrityError:
+            await session.rollback()
+            for params in rows:
+                try:
+                    async with session.begin_nested():
+                        await session.execute(statement, params)
+                except IntegrityError:
+                    logger.info("Courier %s was claimed by another dispatch tick", params['courier'])
+        # executemany doesn't say which rows matched, so read the winners back
+        written = dict((await session.execute(
+            select(Order.id, Order.courier_id).where(Order.id.in_([row.id for row, _, _ in planned]))
+        )).all())
+        await session.commit()
+        assignments = [{"order_id": row.id, "courier_id": courier_id, "distance_km": round(distance, 3)}
+                       for row, courier_id, distance in planned if written.get(row.id) == courier_id]
+        users = {row.id: row.user_id for row, _, _ in planned}
+        for assignment in assignments:
+            await event_bus.publish("order.status_changed", assignment["order_id"],
+                                    users[assignment["order_id"]], "IN_TRANSIT")
+
+    return {
+        "pending_orders": len(orders),
+        "available_couriers": len(couriers),
+        "assigned": len(assignments),
+        "read_ms": round((read - started) * 1000, 2),
+        "match_ms": round((matched - read) * 1000, 2),
+        "total_ms": round((time.perf_counter() - started) * 1000, 2),
+        "assignments": assignments
+    }
+
+
+class Dispatcher:
+    """Runs dispatch_orders() every interval seconds and on demand, never two ticks at once."""
+
+    def __init__(self, interval=DISPATCH_INTERVAL):
+        self.interval = interval
+        self.last_run = None
+        self._lock = LoopLocal(asyncio.Lock)
+        self._task = None
+
+    async def run(self, session):
+        async with self._lock.get():
+            stats = await dispatch_orders(session)
+        self.last_run = {"at": time.time(), **{key: value for key, value in stats.items() if key != "assignments"}}
+        return stats
+
+    async def _tick_forever(self, session_factory):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                async with session_factory() as session:
+                    await self.run(session)
+            except Exception:
+                logger.exception("dispatch tick failed")
+
+    def start(self, session_factory):
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._tick_forever(session_factory))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+dispatcher = Dispatcher()
@@ -0,0 +1,136 @@
+import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi import APIRouter, Depends, Query, status
+from fastapi.exceptions import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Courier, Order
+from schemas import CourierModel, CourierLocationModel
+from dependencies import CurrentUser, get_current_user
+from database import get_db, get_read_db
+from dispatch import dispatcher
+
+dispatch_router = APIRouter(
+    prefix='/dispatch'
+)
+
+MAX_ASSIGNMENTS_PAGE = 1000
+
+
+def courier_to_dict(courier):
+    return {
+        "id": courier.id,
+        "name": courier.name,
+        "is_active": courier.is_active,
+        "lat": courier.lat,
+        "lng": courier.lng,
+        "located_at": courier.located_at
+    }
+
+
+@dispatch_router.post('/couriers', status_code=status.HTTP_201_CREATED)
+async def create_courier(courier: CourierModel, session: AsyncSession = Depends(get_db),
+                         current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        located = courier.lat is not None and courier.lng is not None
+        new_courier = Courier(
+            name=courier.name,
+            is_active=courier.is_active,
+            lat=courier.lat,
+            lng=courier.lng,
+            located_at=datetime.datetime.utcnow() if located else None
+        )
+        session.add(new_courier)
+        await session.commit()
+        data = {
+            "success": True,
+            "code": 201,
+            "message": "Courier is created successfully",
+            "data": courier_to_dict(new_courier)
+        }
+
+        return jsonable_encoder(data)
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admin can add couriers")
+
+
+@dispatch_router.put('/couriers/{id}/location', status_code=status.HTTP_200_OK)
+async def update_courier_location(id: int, location: CourierLocationModel, session: AsyncSession = Depends(get_db),
+                                  current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        values = {"lat": location.lat, "lng": location.lng, "located_at": datetime.datetime.utcnow()}
+        if location.is_active is not None:
+            values["is_active"] = location.is_active
+        result = await session.execute(update(Courier).where(Courier.id == id).values(**values)
+                                       .execution_options(synchronize_session=False))
+        if not result.rowcount:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No courier with this ID {id}")
+        await session.commit()
+        courier = await session.get(Courier, id, populate_existing=True)
+        data = {
+            "success": True,
+            "code": 200,
+            "message": "Courier location is updated",
+            "data": courier_to_dict(courier)
+        }
+
+        return jsonable_encoder(data)
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admin can move couriers")
+
+
+@dispatch_router.post('/run', status_code=status.HTTP_200_OK)
+async def run_dispatch(session: AsyncSession = Depends(get_db),
+                       current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        stats = await dispatcher.run(session)
+        data = {
+            "success": True,
+            "code": 200,
+            "message": f"{stats['assigned']} orders are assigned to couriers",
+            "data": stats
+        }
+
+        return jsonable_encoder(data)
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admin can run dispatch")
+
+
+@dispatch_router.get('/assignments', status_code=status.HTTP_200_OK)
+async def list_assignments(courier_id: int = None, limit: int = Query(100, ge=1, le=MAX_ASSIGNMENTS_PAGE),
+                           session: AsyncSession = Depends(get_read_db),
+                           current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        statement = (select(Order.id, Order.user_id, Order.courier_id, Order.assigned_at,
+                            Order.pickup_lat, Order.pickup_lng, Order.dropoff_lat, Order.dropoff_lng,
+                            Courier.name.label("courier_name"))
+                     .join(Courier, Courier.id == Order.courier_id)
+                     .where(Order.order_statuses == 'IN_TRANSIT'))
+        if courier_id is not None:
+            statement = statement.where(Order.courier_id == courier_id)
+        rows = await session.execute(statement.order_by(Order.id.desc()).limit(limit))
+        data = {
+            "success": True,
+            "code": 200,
+            "message": "Orders in transit with their couriers",
+            "data": {
+                "assignments": [
+                    {
+                        "order_id": row.id,
+                        "user_id": row.user_id,
+                        "courier": {"id": row.courier_id, "name": row.courier_name},
+                        "assigned_at": row.assigned_at,
+                        "pickup": {"lat": row.pickup_lat, "lng": row.pickup_lng},
+                        "dropoff": {"lat": row.dropoff_lat, "lng": row.dropoff_lng}
+                    }
+                    for row in rows
+                ],
+                "last_run": dispatcher.last_run
+            }
+        }
+
+        return jsonable_encoder(data)
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admin can see assignments")
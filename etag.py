@@ -0,0 +1,23 @@
+import hashlib
+
+from fastapi import Response, status
+
+
+def make_etag(*parts):
+    digest = hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    candidates = {candidate.strip().removeprefix('W/') for candidate in header.split(',')}
+    return etag in candidates
+
+
+def not_modified(etag):
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
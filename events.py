@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import time
+
+from cache import LoopLocal
+
+EVENT_BROKER_URL = os.getenv('EVENT_BROKER_URL', 'memory://')
+EVENT_CHANNEL = os.getenv('EVENT_CHANNEL', 'order-events')
+EVENT_BATCH_SIZE = int(os.getenv('EVENT_BATCH_SIZE', '100'))
+EVENT_BATCH_WINDOW = float(os.getenv('EVENT_BATCH_WINDOW_MS', '50')) / 1000
+# batches a slow subscriber may fall behind by before the oldest are dropped
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv('EVENT_SUBSCRIBER_QUEUE_SIZE', '100'))
+SSE_KEEPALIVE = float(os.getenv('SSE_KEEPALIVE_SECONDS', '15'))
+
+
+class LocalBroker:
+    """In-process broker; events only reach subscribers of the same worker."""
+
+    def __init__(self):
+        self._queue = LoopLocal(asyncio.Queue)
+
+    async def publish(self, event):
+        self._queue.get().put_nowait(event)
+
+    async def receive(self, timeout=None):
+        queue = self._queue.get()
+        if not queue.empty():
+            return queue.get_nowait()
+        try:
+            return await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        pass
+
+
+class RedisBroker:
+    """Redis pub/sub broker, so every worker sees every event."""
+
+    def __init__(self, client, channel):
+        self._client = client
+        self._channel = channel
+        self._pubsub = None
+
+    async def publish(self, event):
+        await self._client.publish(self._channel, json.dumps(event))
+
+    async def receive(self, timeout=None):
+        if self._pubsub is None:
+            self._pubsub = self._client.pubsub()
+            await self._pubsub.subscribe(self._channel)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = 1.0 if deadline is None else max(0.0, deadline - time.monotonic())
+            message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=wait)
+            if message is not None:
+                return json.loads(message['data'])
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+
+    async def close(self):
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+
+def event_broker(url, channel):
+    """memory:// (default), redis://host:port/db, or fakeredis:// for a local stand-in."""
+    if url.startswith('memory://'):
+        return LocalBroker()
+    if url.startswith('fakeredis://'):
+        from fakeredis import aioredis as fakeredis
+        return RedisBroker(fakeredis.FakeRedis(), channel)
+    if url.startswith(('redis://', 'rediss://')):
+        import redis.asyncio as redis
+        return RedisBroker(redis.from_url(url), channel)
+    raise ValueError(f"Unsupported event broker: {url}")
+
+
+class Subscription:
+    def __init__(self, user_id):
+        # None receives every user's events (staff)
+        self.user_id = user_id
+        self.dropped = 0
+        self._queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def wants(self, event):
+        return self.user_id is None or event['user_id'] == self.user_id
+
+    def put(self, events):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(events)
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBus:
+    """Collects events for up to EVENT_BATCH_WINDOW and fans each batch out once per subscriber."""
+
+    def __init__(self, broker, batch_size=EVENT_BATCH_SIZE, batch_window=EVENT_BATCH_WINDOW):
+        self.broker = broker
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._subscribers = set()
+        self._task = None
+
+    def _ensure_started(self):
+        # started on first use, so ASGI test clients that skip lifespan still get delivery
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._dispatch())
+
+    async def publish(self, event_type, order_id, user_id, order_statuses=None):
+        self._ensure_started()
+        await self.broker.publish({
+            "type": event_type,
+            "order_id": order_id,
+            "user_id": user_id,
+            "order_statuses": getattr(order_statuses, 'code', order_statuses),
+            "at": time.time()
+        })
+
+    def subscribe(self, user_id=None):
+        self._ensure_started()
+        subscription = Subscription(user_id)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscribers.discard(subscription)
+
+    async def _dispatch(self):
+        while True:
+            batch = [await self.broker.receive()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                event = await self.broker.receive(timeout=max(0.0, deadline - time.monotonic()))
+                if event is None:
+                    break
+                batch.append(event)
+            self._fan_out(batch)
+
+    def _fan_out(self, batch):
+        for subscription in list(self._subscribers):
+            events = [event for event in batch if subscription.wants(event)]
+            if events:
+                subscription.put(events)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.broker.close()
+
+
+event_bus = EventBus(event_broker(EVENT_BROKER_URL, EVENT_CHANNEL))
+
+
+async def sse_stream(request, subscription):
+    """Server-Sent Events: one `orders` event per batch, comments as keepalives."""
+    try:
+        yield ': connected\n\n'
+        while not await request.is_disconnected():
+            events = await subscription.get(timeout=SSE_KEEPALIVE)
+            if events is None:
+                yield ': keepalive\n\n'
+            else:
+                yield f'event: orders\ndata: {json.dumps(events)}\n\n'
+    finally:
+        event_bus.unsubscribe(subscription)
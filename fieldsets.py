@@ -0,0 +1,35 @@
+ORDER_FIELDS = ("id", "quantity", "order_statuses", "product", "unit_price", "total_price", "version", "user")
+
+# nested objects that the normalized view moves into side tables keyed by id
+ORDER_SIDE_TABLES = {"product": "products", "user": "users"}
+
+
+def parse_fields(fields, allowed=ORDER_FIELDS):
+    """`fields=quantity,total_price` -> the selected keys in response order; id is always kept."""
+    if not fields:
+        return None
+    selected = {field.strip() for field in fields.split(',') if field.strip()}
+    unknown = selected.difference(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [field for field in allowed if field in selected or field == "id"]
+
+
+def shape_orders(orders, next_cursor, fields=None, normalized=False):
+    """Applies a sparse fieldset and/or the normalized view to order_to_dict() rows."""
+    if fields is not None:
+        orders = [{field: order[field] for field in fields} for order in orders]
+    page = {"data": orders, "next_cursor": next_cursor}
+    if not normalized:
+        return page
+
+    for nested, table in ORDER_SIDE_TABLES.items():
+        if fields is not None and nested not in fields:
+            continue
+        side_table = page[table] = {}
+        for order in orders:
+            value = order.pop(nested)
+            order[f"{nested}_id"] = value["id"] if value else None
+            if value:
+                side_table[value["id"]] = value
+    return page
@@ -0,0 +1,186 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+
+from fastapi import status
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import HTTPException
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from cache import TTLCache
+from models import IdempotencyKey
+
+# how long a key's response is replayed
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '1024'))
+# how long a duplicate waits for the first request before giving up with 409
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '10'))
+# a claim this old without a response belongs to a request that died; the next one takes it over
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', '30'))
+IDEMPOTENCY_POLL = 0.05
+# expired rows are deleted at most this often per worker
+IDEMPOTENCY_PURGE_INTERVAL = 300
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    fingerprint: str
+    status_code: int
+    body: str
+
+
+def request_fingerprint(endpoint, payload):
+    """sha256 of the endpoint and its payload; a key may only be replayed for the same request."""
+    return hashlib.sha256(json.dumps([endpoint, payload], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Idempotency-Key was already used for a different request")
+    return ORJSONResponse(json.loads(stored.body), status_code=stored.status_code,
+                          headers={"Idempotent-Replayed": "true"})
+
+
+def in_progress():
+    return HTTPException(status_code=status.HTTP_409_CONFLICT,
+                         detail="A request with this Idempotency-Key is still in progress")
+
+
+class IdempotencyStore:
+    """Runs a write once per (user, Idempotency-Key) and replays its response to retries.
+
+    Finished responses live in idempotency_keys with an LRU in front. Within a
+    worker, duplicates of a running request wait on its future; across
+    workers, the first request claims the key with a row whose response is
+    still NULL, and duplicates poll that row until it is filled in. The
+    response is written into that row in the same transaction as the write
+    itself, so a key never ends up with a committed write and no response.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, cache_size=IDEMPOTENCY_CACHE_SIZE, wait=IDEMPOTENCY_WAIT):
+        self.ttl = ttl
+        self.wait = wait
+        self._cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self._in_flight = {}
+        self._purged_at = None
+
+    async def run(self, session, user_id, key, fingerprint, status_code, call):
+        """Returns call()'s result, or the stored response of an earlier request with this key.
+
+        call() writes through session without committing and returns (result,
+        after_commit); run() commits, then awaits after_commit (if not None)
+        for side effects such as events. status_code is the status the result
+        is sent with, so a replay can send the same.
+        """
+        if key is None:
+            result, after_commit = await call()
+            await session.commit()
+            if after_commit is not None:
+                await after_commit()
+            return result
+
+        cache_key = (user_id, key)
+        deadline = time.monotonic() + self.wait
+        while True:
+            stored = self._cache.get(cache_key)
+            if stored is not None:
+                return replay(stored, fingerprint)
+            pending = self._in_flight.get(cache_key)
+            if pending is None:
+                break
+            try:
+                stored = await asyncio.wait_for(asyncio.shield(pending), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise in_progress() from None
+            if stored is not None:
+                return replay(stored, fingerprint)
+            # the first request failed without a response; this one gets to try
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
+        stored = None
+        try:
+            stored, response = await self._run_once(session, user_id, key, fingerprint, status_code, call, deadline)
+            return response
+        finally:
+            del self._in_flight[cache_key]
+            future.set_result(stored)
+
+    async def _run_once(self, session, user_id, key, fingerprint, status_code, call, deadline):
+        claimed = await self._claim(session, user_id, key, fingerprint, deadline)
+        if isinstance(claimed, StoredResponse):
+            return claimed, replay(claimed, fingerprint)
+
+        try:
+            result, after_commit = await call()
+            stored = StoredResponse(fingerprint, status_code, json.dumps(jsonable_encoder(result)))
+            await session.execute(
+                update(IdempotencyKey).where(IdempotencyKey.id == claimed)
+                .values(status_code=stored.status_code, response=stored.body)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            await session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == claimed))
+            await session.commit()
+            raise
+
+        self._cache.set((user_id, key), stored)
+        if after_commit is not None:
+            await after_commit()
+        return stored, result
+
+    async def _claim(self, session, user_id, key, fingerprint, deadline):
+        """Inserts the in-progress row and returns its id, or the StoredResponse another request left."""
+        while True:
+            now = datetime.datetime.utcnow()
+            row = (await session.execute(
+                select(IdempotencyKey.id, IdempotencyKey.fingerprint, IdempotencyKey.status_code,
+                       IdempotencyKey.response, IdempotencyKey.created_at, IdempotencyKey.expires_at)
+                .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+            )).one_or_none()
+            if row is not None and row.expires_at > now:
+                if row.status_code is not None:
+                    stored = StoredResponse(row.fingerprint, row.status_code, row.response)
+                    self._cache.set((user_id, key), stored)
+                    return stored
+                if (now - row.created_at).total_seconds() < IDEMPOTENCY_LOCK_TIMEOUT:
+                    if time.monotonic() >= deadline:
+                        raise in_progress()
+                    await session.rollback()
+                    await asyncio.sleep(IDEMPOTENCY_POLL)
+                    continue
+            if row is not None:
+                # expired, or abandoned by a request that never finished
+                await session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == row.id))
+
+            await self._purge_expired(session, now)
+            claim = IdempotencyKey(user_id=user_id, key=key, fingerprint=fingerprint, created_at=now,
+                                   expires_at=now + datetime.timedelta(seconds=self.ttl))
+            session.add(claim)
+            try:
+                await session.commit()
+            except IntegrityError:
+                # another worker claimed it first
+                await session.rollback()
+                continue
+            session.expunge(claim)
+            return claim.id
+
+    async def _purge_expired(self, session, now):
+        monotonic = time.monotonic()
+        if self._purged_at is not None and monotonic - self._purged_at < IDEMPOTENCY_PURGE_INTERVAL:
+            return
+        self._purged_at = monotonic
+        await session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < now))
+
+
+idempotency_store = IdempotencyStore()
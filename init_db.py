@@ -1,4 +1,7 @@
-from database import Base, engine
-from models import User, Order, Product
+import os
 
-Base.metadata.create_all(bind=engine)
+from alembic import command
+from alembic.config import Config
+
+# Kept as the entry point it always was; the schema itself now lives in migrations/
+command.upgrade(Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alembic.ini')), 'head')
@@ -1,15 +1,41 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from fastapi_jwt_auth import AuthJWT
 
 from auth_routes import auth_router
+from compression import CompressionMiddleware
+from database import SessionLocal
+from dispatch import dispatcher
+from dispatch_routes import dispatch_router
+from events import event_bus
+from metrics import MetricsMiddleware, registry
+from ratelimit import RateLimitMiddleware
 from order_routes import order_router
 from product_routes import product_router
 from schemas import Settings, LoginModel
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app):
+    # the event bus starts on first use; the periodic dispatch tick only runs under a served app
+    dispatcher.start(SessionLocal)
+    yield
+    await dispatcher.close()
+    await event_bus.close()
+
+
+# orjson renders the response models' output without a jsonable_encoder pass
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)
+# runs before compression and routing, so shed requests cost no database work
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.include_router(auth_router)
 app.include_router(order_router)
 app.include_router(product_router)
+app.include_router(dispatch_router)
 
 
 @AuthJWT.load_config
@@ -17,6 +43,11 @@ def get_config():
     return Settings()
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 async def root():
     return {"message": "Hello FastAPI"}
@@ -0,0 +1,262 @@
+import bisect
+import contextlib
+import contextvars
+import logging
+import os
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Statements slower than this are logged with their SQL; 0 turns the log off
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '0'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_query_logger = logging.getLogger('delivery.slow_query')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"'.replace('\n', ' ') for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        return self.header() + [f'{self.name}{format_labels(self.labels, key)} {value}'
+                                for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """A counter that can go down, or whose series are read from callbacks at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.callbacks = {}
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def track(self, callback, *label_values):
+        """Reads the series for label_values from callback(); a None reading leaves it out."""
+        self.callbacks[label_values] = callback
+
+    def render(self):
+        if self.callbacks:
+            readings = ((key, callback()) for key, callback in self.callbacks.items())
+            self.values = {key: value for key, value in readings if value is not None}
+            if not self.values:
+                return []
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            # per-bucket counts, the +Inf count, then the sum
+            series = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = self.header()
+        for key, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                labels = format_labels(self.labels + ('le',), key + (bound,))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {series[-1]}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    'http_requests_total', 'Requests handled, by route template and status.', ('method', 'route', 'status')))
+REQUEST_SECONDS = registry.register(Histogram(
+    'http_request_duration_seconds', 'Request latency by route template.', ('method', 'route')))
+IN_PROGRESS = registry.register(Gauge(
+    'http_requests_in_progress', 'Requests currently being handled.'))
+REQUEST_STATEMENTS = registry.register(Histogram(
+    'http_request_db_statements', 'SQL statements executed per request.', ('method', 'route'), COUNT_BUCKETS))
+REQUEST_DB_SECONDS = registry.register(Histogram(
+    'http_request_db_seconds', 'Time spent in SQL per request.', ('method', 'route')))
+STAGE_SECONDS = registry.register(Histogram(
+    'http_request_stage_seconds', 'Time spent in named request stages such as jwt and user_lookup.', ('stage',)))
+QUERY_SECONDS = registry.register(Histogram(
+    'db_query_duration_seconds', 'Time from cursor execute to result, per statement.'))
+CHECKOUT_SECONDS = registry.register(Histogram(
+    'db_pool_checkout_seconds', 'Time spent waiting for a pooled connection, by engine.', ('engine',)))
+POOL_CHECKED_OUT = registry.register(Gauge(
+    'db_pool_checked_out', 'Connections currently checked out of the pool, by engine.', ('engine',)))
+POOL_SIZE = registry.register(Gauge(
+    'db_pool_size', 'Connections currently held by the pool, by engine.', ('engine',)))
+REQUESTS_SHED = registry.register(Counter(
+    'http_requests_shed_total', 'Requests rejected before routing, by reason (rate_limit, overload).', ('reason',)))
+
+
+class RequestStats:
+    __slots__ = ('statements', 'db_seconds')
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+
+
+request_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+@contextlib.contextmanager
+def observe_stage(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage)
+
+
+def route_template(scope):
+    route = scope.get('route')
+    return getattr(route, 'path', None) or 'unmatched'
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware, so recording adds no extra task or body buffering."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_PROGRESS.dec()
+            request_stats.reset(token)
+            method, route = scope['method'], route_template(scope)
+            REQUESTS.inc(method, route, status_code)
+            REQUEST_SECONDS.observe(elapsed, method, route)
+            REQUEST_STATEMENTS.observe(stats.statements, method, route)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, method, route)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection."""
+    engine_label = 'primary'
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            CHECKOUT_SECONDS.observe(time.perf_counter() - started, self.engine_label)
+
+
+def timed_pool(label):
+    """A TimedQueuePool recording under engine=label; dispose() recreates the pool from its class, so it sticks."""
+    return type(f'TimedQueuePool_{label}', (TimedQueuePool,), {'engine_label': label})
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    QUERY_SECONDS.observe(elapsed)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_query_logger.warning('slow query (%.1f ms): %s', elapsed * 1000, statement)
+
+
+def handle_error(context):
+    # after_cursor_execute never runs for a failed statement; drop its start time
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+
+def pool_reading(engine, method):
+    # dispose() swaps the pool, so it is looked up on every scrape; SQLite pools have no counts
+    def read():
+        pool = engine.sync_engine.pool
+        return getattr(pool, method)() if hasattr(pool, 'checkedout') else None
+    return read
+
+
+def instrument_engine(engine, label='primary'):
+    """Hooks statement timing onto an async engine and exposes its pool occupancy under engine=label."""
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(sync_engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(sync_engine, 'handle_error', handle_error)
+    POOL_CHECKED_OUT.track(pool_reading(engine, 'checkedout'), label)
+    POOL_SIZE.track(pool_reading(engine, 'size'), label)
@@ -0,0 +1,50 @@
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import pool
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import Base, DATABASE_URL
+import models  # noqa: F401  registers the tables on Base.metadata
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def configure(**kwargs):
+    # SQLite can't ALTER most constraints, so its migrations copy the table instead
+    context.configure(
+        target_metadata=target_metadata,
+        render_as_batch=DATABASE_URL.startswith('sqlite'),
+        compare_type=True,
+        **kwargs
+    )
+
+
+def run_migrations_offline():
+    configure(url=DATABASE_URL, literal_binds=True, dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection):
+    configure(connection=connection)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_online():
+    engine = create_async_engine(DATABASE_URL, poolclass=pool.NullPool)
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_migrations_online())
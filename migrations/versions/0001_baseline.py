@@ -0,0 +1,49 @@
+"""baseline schema, as init_db.py used to create it
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+
+Databases created by the old init_db.py already have these tables:
+run `alembic stamp 0001` on them once, then `alembic upgrade head`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('username', sa.String(25), unique=True),
+        sa.Column('email', sa.String(70), unique=True),
+        sa.Column('password', sa.Text(), nullable=True),
+        sa.Column('is_staff', sa.Boolean()),
+        sa.Column('is_active', sa.Boolean()),
+    )
+    op.create_table(
+        'product',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(100)),
+        sa.Column('price', sa.Integer()),
+    )
+    op.create_table(
+        'orders',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('order_statuses', sa.Unicode(255)),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id')),
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('product.id')),
+    )
+
+
+def downgrade():
+    op.drop_table('orders')
+    op.drop_table('product')
+    op.drop_table('user')
@@ -0,0 +1,68 @@
+"""row versions, unique product names, order prices and the daily summary
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+
+Existing orders are priced at their product's current price and get the
+migration time as created_at; the unique name constraint fails if the
+product table already holds duplicate names.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product') as batch:
+        batch.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+        batch.create_unique_constraint('uq_product_name', ['name'])
+
+    with op.batch_alter_table('orders') as batch:
+        batch.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+        batch.add_column(sa.Column('unit_price', sa.Integer()))
+        batch.add_column(sa.Column('total_price', sa.Integer()))
+        batch.add_column(sa.Column('created_at', sa.DateTime()))
+
+    op.execute(
+        "UPDATE orders SET unit_price = (SELECT product.price FROM product WHERE product.id = orders.product_id)"
+    )
+    op.execute("UPDATE orders SET total_price = quantity * unit_price, created_at = CURRENT_TIMESTAMP")
+
+    # SQLite can't add a column with a non-constant default, so the default comes after the backfill
+    with op.batch_alter_table('orders') as batch:
+        batch.alter_column('created_at', server_default=sa.func.now())
+
+    op.create_table(
+        'order_daily_summary',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('product_id', sa.Integer()),
+        sa.Column('user_id', sa.Integer()),
+        sa.Column('order_statuses', sa.String(20), nullable=False),
+        sa.Column('order_count', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.Integer(), nullable=False),
+    )
+    op.create_index('ix_order_daily_summary_day_product_user', 'order_daily_summary',
+                    ['day', 'product_id', 'user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_order_daily_summary_day_product_user', table_name='order_daily_summary')
+    op.drop_table('order_daily_summary')
+
+    with op.batch_alter_table('orders') as batch:
+        batch.drop_column('created_at')
+        batch.drop_column('total_price')
+        batch.drop_column('unit_price')
+        batch.drop_column('version')
+
+    with op.batch_alter_table('product') as batch:
+        batch.drop_constraint('uq_product_name', type_='unique')
+        batch.drop_column('version')
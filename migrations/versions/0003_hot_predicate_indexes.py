@@ -0,0 +1,33 @@
+"""indexes for the hot route predicates
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+
+Order listings filter on one column and page by id, so each composite ends
+in id and also serves as the foreign key index. username and email are
+already covered by their unique constraints.
+"""
+from alembic import op
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_orders_user_id_id', 'orders', ['user_id', 'id'])
+    op.create_index('ix_orders_order_statuses_id', 'orders', ['order_statuses', 'id'])
+    op.create_index('ix_orders_product_id_id', 'orders', ['product_id', 'id'])
+    op.create_index('ix_orders_created_at', 'orders', ['created_at'])
+    op.create_index('ix_product_price', 'product', ['price'])
+
+
+def downgrade():
+    op.drop_index('ix_product_price', table_name='product')
+    op.drop_index('ix_orders_created_at', table_name='orders')
+    op.drop_index('ix_orders_product_id_id', table_name='orders')
+    op.drop_index('ix_orders_order_statuses_id', table_name='orders')
+    op.drop_index('ix_orders_user_id_id', table_name='orders')
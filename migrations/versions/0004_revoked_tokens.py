@@ -0,0 +1,30 @@
+"""revoked token denylist
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'revoked_tokens',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('jti', sa.String(64), nullable=False, unique=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_revoked_tokens_expires_at', 'revoked_tokens', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_revoked_tokens_expires_at', table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')
@@ -0,0 +1,53 @@
+"""couriers and order coordinates for dispatch
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'courier',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(50), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.Column('lat', sa.Float(), nullable=True),
+        sa.Column('lng', sa.Float(), nullable=True),
+        sa.Column('located_at', sa.DateTime(), nullable=True),
+    )
+    with op.batch_alter_table('orders') as batch_op:
+        batch_op.add_column(sa.Column('pickup_lat', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('pickup_lng', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('dropoff_lat', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('dropoff_lng', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('courier_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('assigned_at', sa.DateTime(), nullable=True))
+        batch_op.create_foreign_key('fk_orders_courier_id_courier', 'courier', ['courier_id'], ['id'])
+        batch_op.create_index('ix_orders_courier_id_id', ['courier_id', 'id'])
+        batch_op.create_index('uq_orders_courier_in_transit', ['courier_id'], unique=True,
+                              postgresql_where=sa.text("order_statuses = 'IN_TRANSIT'"),
+                              sqlite_where=sa.text("order_statuses = 'IN_TRANSIT'"))
+
+
+def downgrade():
+    with op.batch_alter_table('orders') as batch_op:
+        batch_op.drop_index('uq_orders_courier_in_transit')
+        batch_op.drop_index('ix_orders_courier_id_id')
+        batch_op.drop_constraint('fk_orders_courier_id_courier', type_='foreignkey')
+        batch_op.drop_column('assigned_at')
+        batch_op.drop_column('courier_id')
+        batch_op.drop_column('dropoff_lng')
+        batch_op.drop_column('dropoff_lat')
+        batch_op.drop_column('pickup_lng')
+        batch_op.drop_column('pickup_lat')
+    op.drop_table('courier')
@@ -0,0 +1,36 @@
+"""idempotency keys for order writes
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(255), nullable=False),
+        sa.Column('fingerprint', sa.String(64), nullable=False),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('response', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_id_key'),
+    )
+    op.create_index('ix_idempotency_keys_expires_at', 'idempotency_keys', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_idempotency_keys_expires_at', table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
@@ -1,5 +1,6 @@
 from database import Base
-from sqlalchemy import Column, Integer, Boolean, Text, String, ForeignKey
+from sqlalchemy import (Column, Integer, Boolean, Float, Text, String, ForeignKey, Date, DateTime, Index,
+                        UniqueConstraint, func, text)
 from sqlalchemy.orm import relationship
 from sqlalchemy_utils.types import ChoiceType
 
@@ -25,6 +26,12 @@ class Order(Base):
         ('IN_TRANSIT', 'in_transit'),
         ('DELIVERED', 'delivered')
     )
+    # the only moves update-status accepts; anything else is a 409
+    STATUS_TRANSITIONS = {
+        'PENDING': ('IN_TRANSIT',),
+        'IN_TRANSIT': ('DELIVERED',),
+        'DELIVERED': ()
+    }
     id = Column(Integer, primary_key=True)
     quantity = Column(Integer, nullable=False)
     order_statuses = Column(ChoiceType(choices=ORDER_STATUSES), default="PENDING")
@@ -32,6 +39,37 @@ class Order(Base):
     user = relationship('User', back_populates='orders')
     product_id = Column(Integer, ForeignKey('product.id'))
     product = relationship('Product', back_populates='orders')
+    # captured when the order is placed, so later price changes don't rewrite history
+    unit_price = Column(Integer)
+    total_price = Column(Integer)
+    created_at = Column(DateTime, server_default=func.now(), index=True)
+    # bumped on every ORM update; read by ETags, set-based updates bump it themselves
+    version = Column(Integer, nullable=False, default=1)
+    # coordinates in degrees; only orders with a pickup point are dispatched
+    pickup_lat = Column(Float, nullable=True)
+    pickup_lng = Column(Float, nullable=True)
+    dropoff_lat = Column(Float, nullable=True)
+    dropoff_lng = Column(Float, nullable=True)
+    courier_id = Column(Integer, ForeignKey('courier.id'), nullable=True)
+    courier = relationship('Courier', back_populates='orders')
+    assigned_at = Column(DateTime, nullable=True)
+
+    __mapper_args__ = {'version_id_col': version}
+    # keyset pagination filters on one column and orders by id, so each index ends in id
+    __table_args__ = (
+        Index('ix_orders_user_id_id', 'user_id', 'id'),
+        Index('ix_orders_order_statuses_id', 'order_statuses', 'id'),
+        Index('ix_orders_product_id_id', 'product_id', 'id'),
+        Index('ix_orders_courier_id_id', 'courier_id', 'id'),
+        # a courier carries one order at a time; concurrent dispatch ticks can't both claim one
+        Index('uq_orders_courier_in_transit', 'courier_id', unique=True,
+              postgresql_where=text("order_statuses = 'IN_TRANSIT'"),
+              sqlite_where=text("order_statuses = 'IN_TRANSIT'")),
+    )
+
+    @classmethod
+    def statuses_before(cls, order_status):
+        return [source for source, targets in cls.STATUS_TRANSITIONS.items() if order_status in targets]
 
     def __repr__(self):
         return f"<order {self.id}"
@@ -40,9 +78,81 @@ class Order(Base):
 class Product(Base):
     __tablename__ = 'product'
     id = Column(Integer, primary_key=True)
-    name = Column(String(100))
-    price = Column(Integer)
+    name = Column(String(100), unique=True)
+    price = Column(Integer, index=True)
     orders = relationship('Order', back_populates='product')
+    version = Column(Integer, nullable=False, default=1)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f"<product {self.name}"
+
+
+class Courier(Base):
+    """A courier and their last reported position; busy while an IN_TRANSIT order is assigned."""
+    __tablename__ = 'courier'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False)
+    # off shift couriers keep their row but are never dispatched
+    is_active = Column(Boolean, nullable=False, default=True)
+    lat = Column(Float, nullable=True)
+    lng = Column(Float, nullable=True)
+    located_at = Column(DateTime, nullable=True)
+    orders = relationship('Order', back_populates='courier')
+
+    def __repr__(self):
+        return f"<courier {self.name}"
+
+
+class OrderDailySummary(Base):
+    """Refreshable rollup of orders per day, product, user and status for analytics."""
+    __tablename__ = 'order_daily_summary'
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    product_id = Column(Integer)
+    user_id = Column(Integer)
+    order_statuses = Column(String(20), nullable=False)
+    order_count = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    revenue = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('ix_order_daily_summary_day_product_user', 'day', 'product_id', 'user_id'),
+    )
+
+    def __repr__(self):
+        return f"<order_daily_summary {self.day}"
+
+
+class RevokedToken(Base):
+    """Denylisted JWT ids; rows can be dropped once the token would have expired anyway."""
+    __tablename__ = 'revoked_tokens'
+    id = Column(Integer, primary_key=True)
+    jti = Column(String(64), unique=True, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<revoked_token {self.jti}"
+
+
+class IdempotencyKey(Base):
+    """The stored response of a request sent with an Idempotency-Key, replayed to retries until expires_at."""
+    __tablename__ = 'idempotency_keys'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    key = Column(String(255), nullable=False)
+    # sha256 of the endpoint and payload; reusing a key for a different request is rejected
+    fingerprint = Column(String(64), nullable=False)
+    # both NULL while the first request is still running
+    status_code = Column(Integer, nullable=True)
+    response = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_id_key'),
+    )
+
+    def __repr__(self):
+        return f"<idempotency_key {self.key}"
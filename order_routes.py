@@ -1,18 +1,128 @@
+import csv
+import datetime
+import io
+import json
+from typing import List, Literal, Optional
+
 from fastapi import APIRouter
 from fastapi_jwt_auth import AuthJWT
 from fastapi.encoders import jsonable_encoder
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Header, Query, Request, status
 from fastapi.exceptions import HTTPException
-
-from models import User, Product, Order
-from schemas import OrderModel, OrderStatusModel
-from database import session, engine
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import delete, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Order
+from analytics import analytics_row, order_analytics, refresh_order_summary, summary_analytics
+from schemas import OrderModel, OrderStatusModel, OrderStatusBulkModel, OrderOut, OrderPage
+from dependencies import CurrentUser, get_current_user
+from database import get_db, get_read_db, read_session
+from product_cache import get_products, load_products
+from etag import make_etag, etag_matches, not_modified
+from events import event_bus, sse_stream
+from fieldsets import parse_fields, shape_orders
+from idempotency import idempotency_store, request_fingerprint
+from order_status import transition_order, transition_orders, write_conflict
+from queries import (order_rows, filter_orders, paginate, user_orders_version,
+                     DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
 
 order_router = APIRouter(
     prefix='/order'
 )
 
-session = session(bind=engine)
+MAX_BULK_ORDERS = 5000
+MAX_BULK_STATUS_UPDATES = 5000
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CSV_COLUMNS = [
+    "id", "quantity", "order_statuses", "unit_price", "total_price",
+    "product_id", "product_name", "product_price",
+    "user_id", "username", "email"
+]
+
+
+def order_product(product):
+    # cached products also carry their version, which order payloads don't expose
+    if product is None:
+        return None
+    return {
+        "id": product["id"],
+        "name": product["name"],
+        "price": product["price"]
+    }
+
+
+async def page_products(session, orders):
+    """Cached products for order_rows() rows, re-read where a row shows a newer version than the cache.
+
+    Listings tag their responses with versions read from the database, so the
+    body has to show those versions too, not what this worker cached earlier.
+    """
+    products = await get_products(session, [order.product_id for order in orders])
+    stale = {order.product_id for order in orders
+             if order.product_id in products and products[order.product_id]["version"] != order.product_version}
+    if stale:
+        products.update(await load_products(session, stale))
+    return products
+
+
+def order_to_dict(order, product):
+    # order is an order_rows() row
+    return {
+        "id": order.id,
+        "quantity": order.quantity,
+        "order_statuses": order.order_statuses.value,
+        "product": order_product(product),
+        "unit_price": order.unit_price,
+        "total_price": order.total_price,
+        "version": order.version,
+        "user": {
+            "id": order.user_id,
+            "username": order.username,
+            "email": order.email
+        },
+    }
+
+
+def order_to_csv_row(order, product):
+    data = order_to_dict(order, product)
+    product = data["product"] or {"id": None, "name": None, "price": None}
+    return [
+        data["id"], data["quantity"], data["order_statuses"], data["unit_price"], data["total_price"],
+        product["id"], product["name"], product["price"],
+        data["user"]["id"], data["user"]["username"], data["user"]["email"]
+    ]
+
+
+async def stream_orders_export(export_format):
+    # Runs while the response is being sent, after get_db has closed, so it owns its session
+    async with read_session() as export_session:
+        orders = await export_session.stream(
+            order_rows().order_by(Order.id).execution_options(
+                yield_per=EXPORT_BATCH_SIZE
+            )
+        )
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == "csv":
+            writer.writerow(EXPORT_CSV_COLUMNS)
+
+        async for batch in orders.partitions():
+            products = await page_products(export_session, batch)
+            for order in batch:
+                product = products.get(order.product_id)
+                if export_format == "csv":
+                    writer.writerow(order_to_csv_row(order, product))
+                else:
+                    buffer.write(json.dumps(order_to_dict(order, product)) + "\n")
+
+            # flush once per fetched batch so the buffer never grows past one batch
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue()
 
 
 @order_router.get('/')
@@ -26,22 +136,36 @@ async def welcome_page(Authorize: AuthJWT = Depends()):
 
 
 @order_router.post('/make', status_code=status.HTTP_201_CREATED)
-async def make_order(order: OrderModel, Authorize: AuthJWT = Depends()):
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
-
-    current_user = Authorize.get_jwt_subject()
-    user = session.query(User).filter(User.username == current_user).first()
+async def make_order(order: OrderModel, session: AsyncSession = Depends(get_db),
+                     current_user: CurrentUser = Depends(get_current_user),
+                     idempotency_key: Optional[str] = Header(None, max_length=255)):
+    return await idempotency_store.run(session, current_user.id, idempotency_key,
+                                       request_fingerprint("POST /order/make", order.dict()),
+                                       status.HTTP_201_CREATED, lambda: create_order(order, session, current_user))
+
+
+async def create_order(order, session, current_user):
+    """Writes the order without committing; returns (response, after_commit) for idempotency_store.run()."""
+    # the price is read in the order's own transaction, never from a possibly stale cache
+    product = (await load_products(session, [order.product_id])).get(order.product_id)
+    if product is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Product with {order.product_id} ID is not found")
 
     new_order = Order(
         quantity=order.quantity,
-        product_id=order.product_id
+        product_id=order.product_id,
+        user_id=current_user.id,
+        unit_price=product["price"],
+        total_price=order.quantity * product["price"],
+        pickup_lat=order.pickup_lat,
+        pickup_lng=order.pickup_lng,
+        dropoff_lat=order.dropoff_lat,
+        dropoff_lng=order.dropoff_lng
     )
-    new_order.user = user
     session.add(new_order)
-    session.commit()
+    await session.flush()
+    await session.refresh(new_order)
 
     data = {
         "success": True,
@@ -51,84 +175,217 @@ async def make_order(order: OrderModel, Authorize: AuthJWT = Depends()):
             "id": new_order.id,
             "quantity": new_order.quantity,
             "order_statuses": new_order.order_statuses.value,
-            "total_price": new_order.quantity * new_order.product.price,
-            "product": {
-                "id": new_order.product.id,
-                "name": new_order.product.name,
-                "price": new_order.product.price
-            }
+            "total_price": new_order.total_price,
+            "product": order_product(product)
         }
     }
 
-    response = data
+    async def after_commit():
+        await event_bus.publish("order.created", new_order.id, current_user.id, new_order.order_statuses)
 
-    return jsonable_encoder(response)
+    return jsonable_encoder(data), after_commit
 
 
-@order_router.get('/list', status_code=status.HTTP_200_OK)
-async def list_all_orders(Authorize: AuthJWT = Depends()):
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
+@order_router.post('/make/bulk', status_code=status.HTTP_201_CREATED)
+async def make_orders_bulk(orders: List[OrderModel], session: AsyncSession = Depends(get_db),
+                           current_user: CurrentUser = Depends(get_current_user),
+                           idempotency_key: Optional[str] = Header(None, max_length=255)):
+    return await idempotency_store.run(session, current_user.id, idempotency_key,
+                                       request_fingerprint("POST /order/make/bulk", [order.dict() for order in orders]),
+                                       status.HTTP_201_CREATED, lambda: create_orders(orders, session, current_user))
+
+
+async def create_orders(orders, session, current_user):
+    """Like create_order(), for a batch in one multi-row INSERT."""
+    if not orders:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No orders given")
+    if len(orders) > MAX_BULK_ORDERS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {MAX_BULK_ORDERS} orders can be created at once")
+
+    product_ids = {order.product_id for order in orders}
+    products = await load_products(session, product_ids)
+    missing = sorted(product_ids - products.keys())
+    if missing:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Products with IDs {missing} are not found")
 
-    current_user = Authorize.get_jwt_subject()
-    user = session.query(User).filter(User.username == current_user).first()
-    if user.is_staff:
-        orders = session.query(Order).all()
-        custom_data = [
+    # one multi-row INSERT ... RETURNING, ids come back in the order of the payload
+    result = await session.execute(
+        insert(Order).returning(Order.id, sort_by_parameter_order=True),
+        [
             {
-                "id": order.id,
                 "quantity": order.quantity,
-                "order_statuses": order.order_statuses.value,
-                "product": {
-                    "id": order.product.id,
-                    "name": order.product.name,
-                    "price": order.product.price
-                },
-                "total_price": order.quantity * order.product.price,
-                "user": {
-                    "id": order.user.id,
-                    "username": order.user.username,
-                    "email": order.user.email
-                },
+                "product_id": order.product_id,
+                "user_id": current_user.id,
+                "unit_price": products[order.product_id]["price"],
+                "total_price": order.quantity * products[order.product_id]["price"],
+                "pickup_lat": order.pickup_lat,
+                "pickup_lng": order.pickup_lng,
+                "dropoff_lat": order.dropoff_lat,
+                "dropoff_lng": order.dropoff_lng
             }
             for order in orders
         ]
+    )
+    order_ids = result.scalars().all()
+
+    pending = dict(Order.ORDER_STATUSES)["PENDING"]
+    custom_data = []
+    for order_id, order in zip(order_ids, orders):
+        product = products[order.product_id]
+        custom_data.append({
+            "id": order_id,
+            "quantity": order.quantity,
+            "order_statuses": pending,
+            "total_price": order.quantity * product["price"],
+            "product": order_product(product)
+        })
 
-        return jsonable_encoder(custom_data)
+    data = {
+        "success": True,
+        "code": 201,
+        "message": f"{len(custom_data)} orders are created successfully",
+        "data": {
+            "orders": custom_data,
+            "total_quantity": sum(order["quantity"] for order in custom_data),
+            "total_price": sum(order["total_price"] for order in custom_data)
+        }
+    }
+
+    async def after_commit():
+        for order_id in order_ids:
+            await event_bus.publish("order.created", order_id, current_user.id, "PENDING")
+
+    return jsonable_encoder(data), after_commit
+
+
+# The listings build their JSON directly: on pydantic v1 a response_model re-validates every row,
+# which costs more than the query. responses= keeps the shapes in the OpenAPI docs.
+@order_router.get('/list', status_code=status.HTTP_200_OK, responses={200: {"model": OrderPage}})
+async def list_all_orders(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                          after: Optional[str] = None,
+                          order_statuses: Optional[str] = None,
+                          user_id: Optional[int] = None,
+                          product_id: Optional[int] = None,
+                          min_price: Optional[int] = None,
+                          max_price: Optional[int] = None,
+                          fields: Optional[str] = None,
+                          view: Literal["nested", "normalized"] = "nested",
+                          session: AsyncSession = Depends(get_read_db),
+                          current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        try:
+            fieldset = parse_fields(fields)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+        query = filter_orders(order_rows(), order_statuses=order_statuses, user_id=user_id,
+                              product_id=product_id, min_price=min_price, max_price=max_price)
+        try:
+            orders, next_cursor = await paginate(session, query, Order.id, limit, after)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        products = await page_products(session, orders)
+        custom_data = [order_to_dict(order, products.get(order.product_id)) for order in orders]
+
+        if fieldset is not None or view == "normalized":
+            return ORJSONResponse(shape_orders(custom_data, next_cursor, fieldset, view == "normalized"))
+        return ORJSONResponse({"data": custom_data, "next_cursor": next_cursor})
     else:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only SuperAdmin can see all orders")
 
 
-@order_router.get('/{id}', status_code=status.HTTP_200_OK)
-async def get_order_by_id(id: int, Authorize: AuthJWT = Depends()):
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
+@order_router.get('/export', status_code=status.HTTP_200_OK)
+async def export_orders(export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+                        current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+        return StreamingResponse(
+            stream_orders_export(export_format),
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename=orders.{export_format}"}
+        )
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only SuperAdmin can export orders")
+
+
+@order_router.get('/events', status_code=status.HTTP_200_OK)
+async def order_events(request: Request, current_user: CurrentUser = Depends(get_current_user)):
+    """Server-Sent Events for the current user's orders, batched by the event bus."""
+    return StreamingResponse(sse_stream(request, event_bus.subscribe(current_user.id)),
+                             media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@order_router.get('/events/all', status_code=status.HTTP_200_OK)
+async def all_order_events(request: Request, current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        return StreamingResponse(sse_stream(request, event_bus.subscribe()),
+                                 media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only SuperAdmin can follow all orders")
+
+
+@order_router.get('/analytics', status_code=status.HTTP_200_OK)
+async def order_analytics_report(group_by: Literal["product", "user", "day"] = "product",
+                                 start: Optional[datetime.date] = None,
+                                 end: Optional[datetime.date] = None,
+                                 source: Literal["live", "summary"] = "live",
+                                 session: AsyncSession = Depends(get_read_db),
+                                 current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        report = order_analytics if source == "live" else summary_analytics
+        rows = (await session.execute(report(group_by, start=start, end=end))).all()
+        data = {
+            "success": True,
+            "code": 200,
+            "message": f"Order analytics by {group_by}",
+            "data": [analytics_row(row) for row in rows]
+        }
+
+        return jsonable_encoder(data)
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only SuperAdmin can see order analytics")
+
+
+@order_router.post('/analytics/refresh', status_code=status.HTTP_200_OK)
+async def refresh_order_analytics(session: AsyncSession = Depends(get_db),
+                                  current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        summary_rows = await refresh_order_summary(session)
+        data = {
+            "success": True,
+            "code": 200,
+            "message": "Order summary is refreshed",
+            "data": {"summary_rows": summary_rows}
+        }
 
-    user = Authorize.get_jwt_subject()
-    current_user = session.query(User).filter(User.username == user).first()
+        return jsonable_encoder(data)
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Only SuperAdmin can refresh order analytics")
 
+
+@order_router.get('/{id}', status_code=status.HTTP_200_OK)
+async def get_order_by_id(id: int, session: AsyncSession = Depends(get_read_db),
+                          current_user: CurrentUser = Depends(get_current_user)):
     if current_user.is_staff:
-        order = session.query(Order).filter(Order.id == id).first()
+        order = (await session.execute(order_rows().where(Order.id == id))).first()
         if order:
+            product = (await page_products(session, [order])).get(order.product_id)
             custom_order = {
                 "id": order.id,
                 "product_id": order.product_id,
                 "quantity": order.quantity,
                 "order_statuses": order.order_statuses.value,
-                "product": {
-                    "id": order.product.id,
-                    "name": order.product.name,
-                    "price": order.product.price
-                },
-                "total_price": order.quantity * order.product.price,
+                "product": order_product(product),
+                "unit_price": order.unit_price,
+                "total_price": order.total_price,
+                "version": order.version,
                 "user": {
-                    "id": order.user.id,
-                    "username": order.user.username,
-                    "email": order.user.email
+                    "id": order.user_id,
+                    "username": order.username,
+                    "email": order.email
                 },
             }
         else:
@@ -139,89 +396,97 @@ async def get_order_by_id(id: int, Authorize: AuthJWT = Depends()):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only SuperAdmin is allowed to this request")
 
 
-@order_router.get('/user/orders', status_code=status.HTTP_200_OK)
-async def get_user_orders(Authorize: AuthJWT = Depends()):
+@order_router.get('/user/orders', status_code=status.HTTP_200_OK, responses={200: {"model": OrderPage}})
+async def get_user_orders(request: Request,
+                          limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                          after: Optional[str] = None,
+                          order_statuses: Optional[str] = None,
+                          product_id: Optional[int] = None,
+                          min_price: Optional[int] = None,
+                          max_price: Optional[int] = None,
+                          fields: Optional[str] = None,
+                          view: Literal["nested", "normalized"] = "nested",
+                          session: AsyncSession = Depends(get_read_db),
+                          current_user: CurrentUser = Depends(get_current_user)):
     try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
-
-    username = Authorize.get_jwt_subject()
-    user = session.query(User).filter(User.username == username).first()
-
-    custom_data = [
-        {
-            "id": order.id,
-            "quantity": order.quantity,
-            "order_statuses": order.order_statuses.value,
-            "product": {
-                "id": order.product.id,
-                "name": order.product.name,
-                "price": order.product.price
-            },
-            "total_price": order.quantity * order.product.price,
-            "user": {
-                "id": order.user.id,
-                "username": order.user.username,
-                "email": order.user.email
-            },
-        }
-        for order in user.orders
-    ]
+        fieldset = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    return jsonable_encoder(custom_data)
+    collection_version = (await session.execute(user_orders_version(current_user.id))).one()
+    etag = make_etag('user-orders', current_user.id, request.url.query, *collection_version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
 
-
-@order_router.get('/user/order/{id}', status_code=status.HTTP_200_OK)
-async def get_user_order_by_id(id: int, Authorize: AuthJWT = Depends()):
+    query = filter_orders(order_rows(), order_statuses=order_statuses, user_id=current_user.id,
+                          product_id=product_id, min_price=min_price, max_price=max_price)
     try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
-
-    username = Authorize.get_jwt_subject()
-    current_user = session.query(User).filter(User.username == username).first()
-    order = session.query(Order).filter(Order.id == id, Order.user == current_user).first()
+        orders, next_cursor = await paginate(session, query, Order.id, limit, after)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    products = await page_products(session, orders)
+    custom_data = [order_to_dict(order, products.get(order.product_id)) for order in orders]
+
+    if fieldset is not None or view == "normalized":
+        return ORJSONResponse(shape_orders(custom_data, next_cursor, fieldset, view == "normalized"),
+                              headers={"ETag": etag})
+    return ORJSONResponse({"data": custom_data, "next_cursor": next_cursor}, headers={"ETag": etag})
+
+
+@order_router.get('/user/order/{id}', status_code=status.HTTP_200_OK, responses={200: {"model": OrderOut}})
+async def get_user_order_by_id(id: int, request: Request,
+                               session: AsyncSession = Depends(get_read_db),
+                               current_user: CurrentUser = Depends(get_current_user)):
+    order = (await session.execute(
+        order_rows().where(Order.id == id, Order.user_id == current_user.id)
+    )).first()
     if order:
-        order_data = {
-            "id": order.id,
-            "quantity": order.quantity,
-            "order_statuses": order.order_statuses.value,
-            "total_price": order.quantity * order.product.price,
-            "product": {
-                "id": order.product.id,
-                "name": order.product.name,
-                "price": order.product.price
-            },
-            "user": {
-                "id": order.user.id,
-                "username": order.user.username,
-                "email": order.user.email
-            },
-        }
-        return jsonable_encoder(order_data)
+        product = (await page_products(session, [order])).get(order.product_id)
+        etag = make_etag('order', order.id, order.version, product["version"] if product else None)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        return ORJSONResponse(order_to_dict(order, product), headers={"ETag": etag})
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No order with this ID {id}")
 
 
 @order_router.put('/{id}/update', status_code=status.HTTP_200_OK)
-async def update_order(id: int, order: OrderModel, Authorize: AuthJWT = Depends()):
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
-
-    username = Authorize.get_jwt_subject()
-    user = session.query(User).filter(User.username == username).first()
-
-    order_to_update = session.query(Order).filter(Order.id == id).first()
-    if order_to_update.user != user:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You can not update other user's order")
-
-    order_to_update.quantity = order.quantity
-    order_to_update.product_id = order.product_id
-
-    session.commit()
+async def update_order(id: int, order: OrderModel, session: AsyncSession = Depends(get_db),
+                       current_user: CurrentUser = Depends(get_current_user),
+                       idempotency_key: Optional[str] = Header(None, max_length=255)):
+    return await idempotency_store.run(session, current_user.id, idempotency_key,
+                                       request_fingerprint(f"PUT /order/{id}/update", order.dict()),
+                                       status.HTTP_200_OK, lambda: apply_order_update(id, order, session, current_user))
+
+
+async def apply_order_update(id, order, session, current_user):
+    """Like create_order(), for an update of a pending order; nothing is published."""
+    product = (await load_products(session, [order.product_id])).get(order.product_id)
+    if product is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Product with {order.product_id} ID is not found")
+
+    # one conditional UPDATE: owner, status and (optionally) version are checked where the write happens,
+    # and changing the contents of an order re-prices it at the current catalog price
+    statement = update(Order).where(Order.id == id, Order.user_id == current_user.id,
+                                    Order.order_statuses == "PENDING")
+    if order.version is not None:
+        statement = statement.where(Order.version == order.version)
+    # coordinates left out of the body keep their current values
+    coordinates = {name: getattr(order, name) for name in ("pickup_lat", "pickup_lng", "dropoff_lat", "dropoff_lng")
+                   if getattr(order, name) is not None}
+    statement = (statement.values(quantity=order.quantity, product_id=order.product_id, unit_price=product["price"],
+                                  total_price=order.quantity * product["price"], version=Order.version + 1,
+                                  **coordinates)
+                 .returning(Order.id, Order.total_price, Order.version)
+                 .execution_options(synchronize_session=False))
+    order_to_update = (await session.execute(statement)).one_or_none()
+    if order_to_update is None:
+        conflict = await write_conflict(session, id, user_id=current_user.id, expected_version=order.version)
+        raise conflict or HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                        detail="You can not update in_transit and delivered orders")
 
     custom_response = {
         "success": True,
@@ -231,60 +496,85 @@ async def update_order(id: int, order: OrderModel, Authorize: AuthJWT = Depends(
             "id": order.id,
             "quantity": order.quantity,
             "product": order.product_id,
-            "order_status": order.order_statuses
+            "total_price": order_to_update.total_price,
+            "order_status": order.order_statuses,
+            "version": order_to_update.version
         }
     }
 
-    return jsonable_encoder(custom_response)
+    return jsonable_encoder(custom_response), None
 
 
-@order_router.patch('/{id}/update-status', status_code=status.HTTP_200_OK)
-async def update_order_status(id: int, order: OrderStatusModel, Authorize: AuthJWT = Depends()):
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
+@order_router.patch('/update-status/bulk', status_code=status.HTTP_200_OK)
+async def update_order_status_bulk(orders: OrderStatusBulkModel, session: AsyncSession = Depends(get_db),
+                                   current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        filters = orders.filter.dict(exclude_none=True) if orders.filter else {}
+        if (orders.ids is None) == (not filters):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Give either ids or a filter")
+        if orders.ids is not None and len(orders.ids) > MAX_BULK_STATUS_UPDATES:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"At most {MAX_BULK_STATUS_UPDATES} orders can be updated at once")
+
+        updated, results = await transition_orders(session, orders.order_statuses, ids=orders.ids,
+                                                   versions=orders.versions, filters=filters,
+                                                   limit=MAX_BULK_STATUS_UPDATES)
+        await session.commit()
+        for row in updated:
+            await event_bus.publish("order.status_changed", row.id, row.user_id, orders.order_statuses)
 
-    username = Authorize.get_jwt_subject()
-    user = session.query(User).filter(User.username == username).first()
+        custom_response = {
+            "success": True,
+            "code": 200,
+            "message": f"{len(updated)} orders are moved to {orders.order_statuses}",
+            "data": {
+                "updated": len(updated),
+                "failed": len(results) - len(updated),
+                "results": results
+            }
+        }
+        return jsonable_encoder(custom_response)
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only SuperAdmin can change order status")
 
-    if user.is_staff:
-        order_to_update = session.query(Order).filter(Order.id == id).first()
-        order_to_update.order_statuses = order.order_statuses
-        session.commit()
+
+@order_router.patch('/{id}/update-status', status_code=status.HTTP_200_OK)
+async def update_order_status(id: int, order: OrderStatusModel, session: AsyncSession = Depends(get_db),
+                              current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        updated = await transition_order(session, id, order.order_statuses, expected_version=order.version)
+        await session.commit()
+        await event_bus.publish("order.status_changed", updated.id, updated.user_id, order.order_statuses)
 
         custom_response = {
             "success": True,
             "code": 200,
             "message": "User's order is updated successfully",
             "data": {
-                "id": order_to_update.id,
-                "order_status": order_to_update.order_statuses
+                "id": updated.id,
+                "order_status": order.order_statuses,
+                "version": updated.version
             }
         }
         return jsonable_encoder(custom_response)
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only SuperAdmin can change order status")
 
 
 @order_router.delete('/{id}/delete', status_code=status.HTTP_204_NO_CONTENT)
-async def delete_order(id: int, Authorize: AuthJWT = Depends()):
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
-
-    username = Authorize.get_jwt_subject()
-    user = session.query(User).filter(User.username == username).first()
-
-    order = session.query(Order).filter(Order.id == id).first()
-    if order.user != user:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You can not delete other user's order")
-
-    if order.order_statuses != "PENDING":
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="You can not delete in_transit and delivered orders")
-
-    session.delete(order)
-    session.commit()
+async def delete_order(id: int, session: AsyncSession = Depends(get_db),
+                       current_user: CurrentUser = Depends(get_current_user)):
+    # conditional DELETE, so an order that leaves PENDING concurrently is never deleted
+    deleted = (await session.execute(
+        delete(Order).where(Order.id == id, Order.user_id == current_user.id, Order.order_statuses == "PENDING")
+        .returning(Order.id).execution_options(synchronize_session=False)
+    )).one_or_none()
+    if deleted is None:
+        conflict = await write_conflict(session, id, user_id=current_user.id, action="delete")
+        raise conflict or HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                        detail="You can not delete in_transit and delivered orders")
+    await session.commit()
+    await event_bus.publish("order.deleted", id, current_user.id, "PENDING")
     custom_response = {
         "success": True,
         "code": 200,
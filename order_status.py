@@ -0,0 +1,110 @@
+from fastapi import status
+from fastapi.exceptions import HTTPException
+from sqlalchemy import or_, select, tuple_, update
+
+from models import Order
+
+
+def status_code(order_status):
+    """ChoiceType hands back Choice objects on load and plain strings on assignment."""
+    return getattr(order_status, 'code', order_status)
+
+
+async def write_conflict(session, id, user_id=None, expected_version=None, action="update"):
+    """Explains why a conditional write matched no row.
+
+    Returns the HTTPException for a missing order, another user's order or a stale
+    version, or None when the order's status is what blocked the write.
+    """
+    row = (await session.execute(
+        select(Order.user_id, Order.order_statuses, Order.version).where(Order.id == id)
+    )).one_or_none()
+    if row is None:
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No order with this ID {id}")
+    if user_id is not None and row.user_id != user_id:
+        return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"You can not {action} other user's order")
+    if expected_version is not None and row.version != expected_version:
+        return HTTPException(status_code=status.HTTP_409_CONFLICT,
+                             detail=f"Order {id} was changed concurrently, its current version is {row.version}")
+    return None
+
+
+async def transition_order(session, id, order_status, expected_version=None):
+    """Moves one order along STATUS_TRANSITIONS with a single conditional UPDATE.
+
+    The WHERE clause carries the allowed source statuses (and the expected version,
+    if given), so concurrent writers can't both win and no row lock is held.
+    Returns (id, user_id, version) of the updated row; the caller commits.
+    """
+    statement = update(Order).where(Order.id == id, Order.order_statuses.in_(Order.statuses_before(order_status)))
+    if expected_version is not None:
+        statement = statement.where(Order.version == expected_version)
+    statement = (statement.values(order_statuses=order_status, version=Order.version + 1)
+                 .returning(Order.id, Order.user_id, Order.version)
+                 .execution_options(synchronize_session=False))
+    row = (await session.execute(statement)).one_or_none()
+    if row is not None:
+        return row
+
+    conflict = await write_conflict(session, id, expected_version=expected_version)
+    if conflict is not None:
+        raise conflict
+    current = await session.scalar(select(Order.order_statuses).where(Order.id == id))
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                        detail=f"Order {id} can not move from {status_code(current)} to {order_status}")
+
+
+def transition_result(id, http_status, detail=None, row=None):
+    return {
+        "id": id,
+        "success": http_status == status.HTTP_200_OK,
+        "status": http_status,
+        "detail": detail,
+        "version": row.version if row is not None else None
+    }
+
+
+async def transition_orders(session, order_status, ids=None, versions=None, filters=None, limit=None):
+    """Applies one transition to many orders with a single set-based UPDATE.
+
+    Orders come from explicit ids (entries in versions pin an id to the version
+    the caller last saw) or from filters (column -> value), capped at limit.
+    Returns (updated rows, per-id results); ids that matched nothing get a
+    404/409 result from one follow-up SELECT. The caller commits.
+    """
+    allowed = Order.order_statuses.in_(Order.statuses_before(order_status))
+    if ids is not None:
+        versions = versions or {}
+        unpinned = [id for id in ids if id not in versions]
+        pinned = [(id, versions[id]) for id in ids if id in versions]
+        targets = or_(Order.id.in_(unpinned), tuple_(Order.id, Order.version).in_(pinned))
+    else:
+        candidates = select(Order.id).where(allowed, *(getattr(Order, column) == value
+                                                       for column, value in filters.items()))
+        targets = Order.id.in_(candidates.order_by(Order.id).limit(limit))
+
+    statement = (update(Order).where(targets, allowed)
+                 .values(order_statuses=order_status, version=Order.version + 1)
+                 .returning(Order.id, Order.user_id, Order.version)
+                 .execution_options(synchronize_session=False))
+    updated = (await session.execute(statement)).all()
+    results = {row.id: transition_result(row.id, status.HTTP_200_OK, row=row) for row in updated}
+
+    missed = [id for id in dict.fromkeys(ids or ()) if id not in results]
+    if missed:
+        current = {row.id: row for row in await session.execute(
+            select(Order.id, Order.order_statuses, Order.version).where(Order.id.in_(missed))
+        )}
+        for id in missed:
+            row = current.get(id)
+            if row is None:
+                results[id] = transition_result(id, status.HTTP_404_NOT_FOUND, f"No order with this ID {id}")
+            elif id in versions and row.version != versions[id]:
+                results[id] = transition_result(id, status.HTTP_409_CONFLICT,
+                                                f"Order {id} was changed concurrently", row=row)
+            else:
+                results[id] = transition_result(
+                    id, status.HTTP_409_CONFLICT,
+                    f"Order {id} can not move from {status_code(row.order_statuses)} to {order_status}", row=row
+                )
+    return updated, list(results.values())
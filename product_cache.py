@@ -0,0 +1,108 @@
+import os
+import time
+
+from sqlalchemy import select
+
+from cache import cache_backend
+from models import Product
+
+PRODUCT_CACHE_URL = os.getenv('PRODUCT_CACHE_URL', 'memory://')
+PRODUCT_CACHE_SIZE = int(os.getenv('PRODUCT_CACHE_SIZE', '10000'))
+PRODUCT_CACHE_TTL = int(os.getenv('PRODUCT_CACHE_TTL', '300'))
+
+product_cache = cache_backend(PRODUCT_CACHE_URL, prefix='product:',
+                              maxsize=PRODUCT_CACHE_SIZE, ttl=PRODUCT_CACHE_TTL)
+
+# Listings are cached under the current generation; any product write starts a new one
+GENERATION_KEY = 'generation'
+
+
+def product_to_dict(product):
+    return {
+        "id": product.id,
+        "name": product.name,
+        "price": product.price,
+        "version": product.version
+    }
+
+
+def from_replica(session):
+    # replicas may lag the primary, so what they return is served but never cached
+    return session.info.get('replica') is not None
+
+
+async def get_product(session, product_id):
+    if product_id is None:
+        return None
+    product = await product_cache.get(f"id:{product_id}")
+    if product is None:
+        db_product = await session.get(Product, product_id)
+        if db_product is None:
+            return None
+        product = product_to_dict(db_product)
+        if not from_replica(session):
+            await product_cache.set(f"id:{product_id}", product)
+    return product
+
+
+async def get_products(session, product_ids):
+    """Maps each id to its cached product dict, loading misses with one IN query."""
+    product_ids = [product_id for product_id in set(product_ids) if product_id is not None]
+    cached = await product_cache.get_many([f"id:{product_id}" for product_id in product_ids])
+    products = {product_id: product for product_id, product in zip(product_ids, cached) if product is not None}
+
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        for db_product in await session.scalars(select(Product).where(Product.id.in_(missing))):
+            product = product_to_dict(db_product)
+            products[db_product.id] = product
+            if not from_replica(session):
+                await product_cache.set(f"id:{db_product.id}", product)
+    return products
+
+
+async def load_products(session, product_ids):
+    """Like get_products() but always reads session, for prices that are written into orders.
+
+    The cache may lag a price change made on another worker; what is read
+    here is fresh, so it is put back into the cache as well (unless it came
+    from a replica).
+    """
+    product_ids = [product_id for product_id in set(product_ids) if product_id is not None]
+    products = {}
+    if product_ids:
+        for db_product in await session.scalars(select(Product).where(Product.id.in_(product_ids))
+                                                .execution_options(populate_existing=True)):
+            product = product_to_dict(db_product)
+            products[db_product.id] = product
+            if not from_replica(session):
+                await product_cache.set(f"id:{db_product.id}", product)
+    return products
+
+
+async def list_generation():
+    generation = await product_cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = time.time_ns()
+        await product_cache.set(GENERATION_KEY, generation)
+    return generation
+
+
+async def get_product_list(key):
+    return await product_cache.get(f"list:{await list_generation()}:{key}")
+
+
+async def set_product_list(session, key, value):
+    if from_replica(session):
+        return
+    await product_cache.set(f"list:{await list_generation()}:{key}", value)
+
+
+async def invalidate_product(product_id=None):
+    if product_id is not None:
+        await product_cache.delete(f"id:{product_id}")
+    await product_cache.set(GENERATION_KEY, time.time_ns())
+
+
+async def invalidate_all_products():
+    await product_cache.clear()
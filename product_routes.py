@@ -1,36 +1,121 @@
+import csv
+import json
+from typing import Literal, Optional
+
 from fastapi import APIRouter
-from fastapi_jwt_auth import AuthJWT
 from fastapi.encoders import jsonable_encoder
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, File, Query, Request, UploadFile, status
 from fastapi.exceptions import HTTPException
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from models import User, Product
-from schemas import ProductModel
-from database import session, engine
+from models import Product, Order
+from schemas import ProductModel, ProductOut, ProductPage
+from dependencies import CurrentUser, get_current_user
+from database import get_db, get_read_db
+from product_cache import (get_product, get_product_list, set_product_list, invalidate_product,
+                           invalidate_all_products, product_to_dict)
+from etag import make_etag, etag_matches, not_modified
+from queries import (filter_products, paginate, product_rows, product_list_version,
+                     DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
 
 product_router = APIRouter(
     prefix='/product'
 )
 
-session = session(bind=engine)
+IMPORT_BATCH_SIZE = 1000
+IMPORT_CHUNK_SIZE = 64 * 1024
+IMPORT_MAX_ERRORS = 100
+
+
+def duplicate_name(name):
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                         detail=f"Product with this name {name!r} already exists")
+
+
+async def iter_upload_lines(upload):
+    # Reads the upload in fixed chunks, so memory doesn't depend on file size
+    pending = b''
+    while chunk := await upload.read(IMPORT_CHUNK_SIZE):
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def iter_import_rows(upload, import_format):
+    header = None
+    line_number = 0
+    async for line in iter_upload_lines(upload):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            # one bad line is rejected on its own instead of failing the whole import
+            line = line.decode('utf-8').rstrip('\r')
+            if import_format == 'csv':
+                values = next(csv.reader([line]))
+                if header is None:
+                    header = [value.strip() for value in values]
+                    continue
+                row = dict(zip(header, values))
+            else:
+                row = json.loads(line)
+            if not isinstance(row, dict):
+                raise TypeError(f"Expected a JSON object, got {type(row).__name__}")
+            product = ProductModel(**row)
+        except (ValueError, TypeError) as e:
+            yield line_number, None, str(e)
+        else:
+            yield line_number, product, None
+
+
+def product_out(product):
+    # the ProductOut shape; cached product dicts also carry the version their ETag is built from
+    return {"id": product["id"], "name": product["name"], "price": product["price"]}
+
+
+def product_upsert(dialect_name):
+    dialect_insert = postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+    statement = dialect_insert(Product)
+    return statement.on_conflict_do_update(
+        index_elements=[Product.name],
+        set_={'price': statement.excluded.price, 'version': Product.version + 1}
+    )
+
+
+async def upsert_products(session, batch):
+    """Upserts one batch keyed by name; returns (inserted, updated)."""
+    rows = {product.name: {'name': product.name, 'price': product.price} for product in batch}
+    existing = set((await session.scalars(select(Product.name).where(Product.name.in_(rows.keys())))).all())
+    await session.execute(product_upsert(session.bind.dialect.name), list(rows.values()))
+    await session.commit()
+    await invalidate_all_products()
+    inserted = len(rows.keys() - existing)
+    return inserted, len(batch) - inserted
 
 
 @product_router.post('/create', status_code=status.HTTP_201_CREATED)
-async def create_product(product: ProductModel, Authorize: AuthJWT = Depends()):
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
-
-    user = Authorize.get_jwt_subject()
-    current_user = session.query(User).filter(User.username == user).first()
+async def create_product(product: ProductModel, session: AsyncSession = Depends(get_db),
+                         current_user: CurrentUser = Depends(get_current_user)):
     if current_user.is_staff:
         new_product = Product(
             name=product.name,
             price=product.price
         )
         session.add(new_product)
-        session.commit()
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            raise duplicate_name(product.name) from None
+        await invalidate_product()
         data = {
             "success": True,
             "code": 201,
@@ -47,70 +132,126 @@ async def create_product(product: ProductModel, Authorize: AuthJWT = Depends()):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admin can add new product")
 
 
-@product_router.get('/list', status_code=status.HTTP_200_OK)
-async def list_all_products(Authorize: AuthJWT = Depends()):
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
-
-    user = Authorize.get_jwt_subject()
-    current_user = session.query(User).filter(User.username == user).first()
+@product_router.post('/import', status_code=status.HTTP_200_OK)
+async def import_products(file: UploadFile = File(...),
+                          import_format: Optional[Literal["ndjson", "csv"]] = Query(None, alias="format"),
+                          session: AsyncSession = Depends(get_db),
+                          current_user: CurrentUser = Depends(get_current_user)):
     if current_user.is_staff:
-        products = session.query(Product).all()
-        custom_data = [
-            {
-                "id": product.id,
-                "name": product.name,
-                "price": product.price
+        if import_format is None:
+            import_format = "csv" if (file.filename or "").lower().endswith(".csv") else "ndjson"
+
+        inserted = updated = rejected = 0
+        errors = []
+        batch = []
+
+        async def flush():
+            nonlocal inserted, updated, rejected
+            try:
+                batch_inserted, batch_updated = await upsert_products(session, [product for _, product in batch])
+            except DBAPIError as e:
+                # earlier batches are committed; report this one as rejected and carry on
+                await session.rollback()
+                rejected += len(batch)
+                if len(errors) < IMPORT_MAX_ERRORS:
+                    errors.append({"line": batch[0][0],
+                                   "error": f"Lines {batch[0][0]}-{batch[-1][0]} were not imported: {e.orig}"})
+            else:
+                inserted += batch_inserted
+                updated += batch_updated
+            batch.clear()
+
+        async for line_number, product, error in iter_import_rows(file, import_format):
+            if error is not None:
+                rejected += 1
+                if len(errors) < IMPORT_MAX_ERRORS:
+                    errors.append({"line": line_number, "error": error})
+                continue
+            batch.append((line_number, product))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await flush()
+        if batch:
+            await flush()
+
+        data = {
+            "success": True,
+            "code": 200,
+            "message": "Products are imported",
+            "data": {
+                "inserted": inserted,
+                "updated": updated,
+                "rejected": rejected,
+                "errors": errors
             }
-            for product in products
-        ]
-        return jsonable_encoder(custom_data)
+        }
+
+        return jsonable_encoder(data)
     else:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admin can add see all products")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admin can import products")
 
 
-@product_router.get('/{id}', status_code=status.HTTP_200_OK)
-async def get_product_by_id(id: int, Authorize: AuthJWT = Depends()):
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
+# Built as JSON directly, like the order listings; responses= keeps the shapes in the docs
+@product_router.get('/list', status_code=status.HTTP_200_OK, responses={200: {"model": ProductPage}})
+async def list_all_products(request: Request,
+                            limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                            after: Optional[str] = None,
+                            min_price: Optional[int] = None,
+                            max_price: Optional[int] = None,
+                            session: AsyncSession = Depends(get_read_db),
+                            current_user: CurrentUser = Depends(get_current_user)):
+    if current_user.is_staff:
+        table_version = (await session.execute(product_list_version())).one()
+        etag = make_etag('products', request.url.query, *table_version)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        cache_key = f"{limit}:{after}:{min_price}:{max_price}"
+        page = await get_product_list(cache_key)
+        if page is None:
+            query = filter_products(product_rows(), min_price=min_price, max_price=max_price)
+            try:
+                products, next_cursor = await paginate(session, query, Product.id, limit, after)
+            except ValueError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            custom_data = [product_out(product_to_dict(product)) for product in products]
+            page = {"data": custom_data, "next_cursor": next_cursor}
+            await set_product_list(session, cache_key, page)
+        return ORJSONResponse(page, headers={"ETag": etag})
+    else:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admin can add see all products")
 
-    user = Authorize.get_jwt_subject()
-    current_user = session.query(User).filter(User.username == user).first()
 
+@product_router.get('/{id}', status_code=status.HTTP_200_OK, responses={200: {"model": ProductOut}})
+async def get_product_by_id(id: int, request: Request,
+                            session: AsyncSession = Depends(get_read_db),
+                            current_user: CurrentUser = Depends(get_current_user)):
     if current_user.is_staff:
-        product = session.query(Product).filter(Product.id == id).first()
+        product = await get_product(session, id)
         if product:
-            custom_order = {
-                "id": product.id,
-                "name": product.name,
-                "price": product.price,
-            }
+            etag = make_etag('product', product["id"], product["version"])
+            if etag_matches(request, etag):
+                return not_modified(etag)
         else:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with {id} ID is not found")
 
-        return jsonable_encoder(custom_order)
+        return ORJSONResponse(product_out(product), headers={"ETag": etag})
     else:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only SuperAdmin is allowed to this request")
 
 
 @product_router.delete('/{id}/delete', status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product_by_id(id: int, Authorize: AuthJWT = Depends()):
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
-
-    user = Authorize.get_jwt_subject()
-    current_user = session.query(User).filter(User.username == user).first()
+async def delete_product_by_id(id: int, session: AsyncSession = Depends(get_db),
+                               current_user: CurrentUser = Depends(get_current_user)):
     if current_user.is_staff:
-        product = session.query(Product).filter(Product.id == id).first()
+        product = await session.get(Product, id)
         if product:
-            session.delete(product)
-            session.commit()
+            # set-based, so the product's orders are never loaded into the session
+            await session.execute(
+                update(Order).where(Order.product_id == id).values(product_id=None, version=Order.version + 1)
+            )
+            await session.execute(delete(Product).where(Product.id == id))
+            await session.commit()
+            await invalidate_product(id)
             data = {
                 "success": True,
                 "code": 200,
@@ -129,20 +270,24 @@ async def delete_product_by_id(id: int, Authorize: AuthJWT = Depends()):
 
 
 @product_router.put('/{id}/update', status_code=status.HTTP_200_OK)
-async def update_product_by_id(id: int, updated_data: ProductModel, Authorize: AuthJWT = Depends()):
-    try:
-        Authorize.jwt_required()
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Enter valid access token")
-
-    user = Authorize.get_jwt_subject()
-    current_user = session.query(User).filter(User.username == user).first()
+async def update_product_by_id(id: int, updated_data: ProductModel, session: AsyncSession = Depends(get_db),
+                               current_user: CurrentUser = Depends(get_current_user)):
     if current_user.is_staff:
-        product = session.query(Product).filter(Product.id == id).first()
+        product = await session.get(Product, id)
         if product:
             for key, value in updated_data.dict(exclude_unset=True).items():
                 setattr(product, key, value)
-            session.commit()
+            try:
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                raise duplicate_name(updated_data.name) from None
+            except StaleDataError:
+                # the version check on the UPDATE lost to another update or an import
+                await session.rollback()
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail=f"Product {id} was changed concurrently, try again") from None
+            await invalidate_product(id)
             data = {
                 "success": True,
                 "code": 200,
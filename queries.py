@@ -0,0 +1,94 @@
+import base64
+import json
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+
+from models import Order, Product, User
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def order_rows():
+    """Flat order + user projection in one SELECT; products come from product_cache.
+
+    product_version is the product's version as this SELECT saw it, so a stale
+    cached product can be told apart (see page_products() in order_routes).
+    """
+    # aliased so it doesn't correlate with the EXISTS that filter_orders() adds for prices
+    product = aliased(Product)
+    return select(
+        Order.id, Order.quantity, Order.order_statuses, Order.product_id, Order.version,
+        Order.unit_price, Order.total_price,
+        User.id.label('user_id'), User.username, User.email,
+        product.version.label('product_version')
+    ).join(Order.user).outerjoin(product, product.id == Order.product_id)
+
+
+def product_rows():
+    return select(Product.id, Product.name, Product.price, Product.version)
+
+
+def encode_cursor(last_id):
+    raw = json.dumps({'id': last_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))['id']
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(last_id, int):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return last_id
+
+
+async def paginate(session, query, id_column, limit, after=None):
+    """Keyset page over id_column; returns (rows, next_cursor)."""
+    if after is not None:
+        query = query.where(id_column > decode_cursor(after))
+    rows = (await session.execute(query.order_by(id_column).limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    return rows, next_cursor
+
+
+def filter_orders(query, order_statuses=None, user_id=None, product_id=None,
+                  min_price=None, max_price=None):
+    if order_statuses is not None:
+        query = query.where(Order.order_statuses == order_statuses)
+    if user_id is not None:
+        query = query.where(Order.user_id == user_id)
+    if product_id is not None:
+        query = query.where(Order.product_id == product_id)
+    if min_price is not None:
+        query = query.where(Order.product.has(Product.price >= min_price))
+    if max_price is not None:
+        query = query.where(Order.product.has(Product.price <= max_price))
+    return query
+
+
+def filter_products(query, min_price=None, max_price=None):
+    if min_price is not None:
+        query = query.where(Product.price >= min_price)
+    if max_price is not None:
+        query = query.where(Product.price <= max_price)
+    return query
+
+
+# Collection ETags: any insert, delete or version bump changes one of these aggregates
+def product_list_version():
+    return select(func.count(Product.id), func.max(Product.id), func.sum(Product.version))
+
+
+def user_orders_version(user_id):
+    # orders embed product name/price, so the versions of their products are part of the fingerprint
+    user_products = select(Order.product_id).where(Order.user_id == user_id)
+    return select(
+        func.count(Order.id), func.max(Order.id), func.sum(Order.version),
+        select(func.sum(Product.version)).where(Product.id.in_(user_products)).scalar_subquery()
+    ).where(Order.user_id == user_id)
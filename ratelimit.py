@@ -0,0 +1,206 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import time
+
+from starlette.requests import Request
+
+from cache import LoopLocal, TTLCache
+from dependencies import bearer_token, token_cache, token_key
+from metrics import REQUESTS_SHED
+
+# `[METHOD ]path-prefix=requests/seconds`, first match wins; empty turns rate limiting off
+RATE_LIMIT_RULES = os.getenv(
+    'RATE_LIMIT_RULES',
+    'POST /auth/login=10/60; POST /auth/signup=5/60; /auth=60/60; '
+    'POST /order/make=60/60; /order=300/60; /product=300/60'
+)
+# memory:// keeps buckets per worker; shm:///dev/shm/delivery-ratelimit shares them across workers on one host
+RATE_LIMIT_BACKEND_URL = os.getenv('RATE_LIMIT_BACKEND_URL', 'memory://')
+RATE_LIMIT_SLOTS = int(os.getenv('RATE_LIMIT_SLOTS', '65536'))
+# requests in flight per worker before new ones queue; 0 turns the cap off
+MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', '64'))
+# how long a request may queue for a slot before it is shed with 503
+ADMISSION_TIMEOUT = float(os.getenv('ADMISSION_TIMEOUT_MS', '100')) / 1000
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '1'))
+# long-lived streams would hold a slot for their whole life, and scrapes must see an overloaded worker
+ADMISSION_EXEMPT_PATHS = ('/order/events', '/metrics')
+
+
+class RateRule:
+    def __init__(self, method, prefix, requests, seconds):
+        self.method = method
+        self.prefix = prefix
+        self.burst = requests
+        self.rate = requests / seconds
+        self.name = f"{method or '*'} {prefix}"
+
+    def matches(self, method, path):
+        return (self.method is None or self.method == method) and path.startswith(self.prefix)
+
+
+def parse_rules(rules):
+    """'POST /auth/login=10/60; /order=300/60' -> [RateRule]; raises ValueError on a malformed rule."""
+    parsed = []
+    for rule in filter(None, (rule.strip() for rule in rules.split(';'))):
+        try:
+            target, limit = rule.rsplit('=', 1)
+            requests, seconds = (float(part) for part in limit.split('/'))
+            method, _, prefix = target.strip().rpartition(' ')
+        except ValueError:
+            raise ValueError(f"Malformed rate limit rule: {rule!r}") from None
+        if not prefix.startswith('/') or requests < 1 or seconds <= 0:
+            raise ValueError(f"Malformed rate limit rule: {rule!r}")
+        parsed.append(RateRule(method.strip().upper() or None, prefix, requests, seconds))
+    return parsed
+
+
+def refill(tokens, updated, now, rate, burst):
+    """Token bucket step: returns (allowed, tokens left, seconds until the next token)."""
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    """Per-worker buckets; an idle bucket expires once it would have refilled anyway."""
+
+    def __init__(self, maxsize=RATE_LIMIT_SLOTS):
+        self._buckets = TTLCache(maxsize=maxsize)
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        allowed, tokens, retry_after = refill(tokens, updated, now, rate, burst)
+        self._buckets.set(key, (tokens, now), ttl=(burst - tokens) / rate)
+        return allowed, retry_after
+
+
+class SharedMemoryBuckets:
+    """Buckets in an mmap'd file that every worker on the host maps.
+
+    The file is a set-associative table: a key hashes to one set of WAYS slots
+    (hash, tokens, updated), guarded by an fcntl lock on that set's bytes. A full
+    set evicts its least recently used slot; the evicted client just starts
+    again from a full bucket. CLOCK_MONOTONIC is shared by all processes.
+    """
+    SLOT = struct.Struct('<Qdd')
+    WAYS = 8
+
+    def __init__(self, path, slots=RATE_LIMIT_SLOTS):
+        self.sets = max(1, slots // self.WAYS)
+        self.set_size = self.WAYS * self.SLOT.size
+        size = self.sets * self.set_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def take(self, key, rate, burst):
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        base = digest % self.sets * self.set_size
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.set_size, base)
+        try:
+            now = time.monotonic()
+            slot, victim, victim_updated = None, base, math.inf
+            for offset in range(base, base + self.set_size, self.SLOT.size):
+                stored, tokens, updated = self.SLOT.unpack_from(self._map, offset)
+                if stored == digest:
+                    slot = offset
+                    break
+                if stored == 0:
+                    updated = -math.inf
+                if updated < victim_updated:
+                    victim, victim_updated = offset, updated
+            if slot is None:
+                slot, tokens, updated = victim, burst, now
+            allowed, tokens, retry_after = refill(tokens, updated, now, rate, burst)
+            self.SLOT.pack_into(self._map, slot, digest, tokens, now)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.set_size, base)
+        return allowed, retry_after
+
+
+def rate_limit_backend(url):
+    """memory:// (default) or shm:///path/to/file for buckets shared by every worker on the host."""
+    if url.startswith('memory://'):
+        return MemoryBuckets()
+    if url.startswith('shm://'):
+        return SharedMemoryBuckets(url[len('shm://'):] or '/dev/shm/delivery-ratelimit')
+    raise ValueError(f"Unsupported rate limit backend: {url}")
+
+
+def client_key(scope):
+    """The user id of an already verified bearer token, else the client address.
+
+    Unverified tokens aren't trusted here, or a client could mint a fresh
+    subject per request; get_verified_token() fills token_cache on first use.
+    """
+    token = bearer_token(Request(scope))
+    if token is not None:
+        verified = token_cache.get(token_key(token))
+        if verified is not None:
+            return f"user:{verified.user.id}"
+    client = scope.get('client')
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+async def reject(send, status_code, detail, retry_after):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            (b'retry-after', str(retry_after).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class RateLimitMiddleware:
+    """Sheds load before routing: 429 past a client's token bucket, 503 when the worker is saturated."""
+
+    def __init__(self, app, rules=None, backend=None, max_concurrent=MAX_CONCURRENT_REQUESTS,
+                 admission_timeout=ADMISSION_TIMEOUT):
+        self.app = app
+        self.rules = parse_rules(RATE_LIMIT_RULES) if rules is None else rules
+        self.backend = rate_limit_backend(RATE_LIMIT_BACKEND_URL) if backend is None else backend
+        self.max_concurrent = max_concurrent
+        self.admission_timeout = admission_timeout
+        self._semaphore = LoopLocal(lambda: asyncio.Semaphore(self.max_concurrent))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        method, path = scope['method'], scope['path']
+        rule = next((rule for rule in self.rules if rule.matches(method, path)), None)
+        if rule is not None:
+            allowed, retry_after = self.backend.take(f"{rule.name}|{client_key(scope)}", rule.rate, rule.burst)
+            if not allowed:
+                REQUESTS_SHED.inc('rate_limit')
+                return await reject(send, 429, "Too many requests", math.ceil(retry_after))
+
+        if self.max_concurrent <= 0 or path.startswith(ADMISSION_EXEMPT_PATHS):
+            return await self.app(scope, receive, send)
+        semaphore = self._semaphore.get()
+        if semaphore.locked():
+            try:
+                await asyncio.wait_for(semaphore.acquire(), self.admission_timeout)
+            except asyncio.TimeoutError:
+                REQUESTS_SHED.inc('overload')
+                return await reject(send, 503, "Server is busy, try again shortly", ADMISSION_RETRY_AFTER)
+        else:
+            await semaphore.acquire()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            semaphore.release()
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, validator
-from typing import Optional
+from pydantic import BaseModel, conint, constr, validator
+from typing import Dict, List, Optional
 
 
 class SignUpModel(BaseModel):
@@ -38,12 +38,24 @@ class LoginModel(BaseModel):
     password: str
 
 
+class LogoutModel(BaseModel):
+    # revoked along with the access token when given
+    refresh: Optional[str] = None
+
+
 class OrderModel(BaseModel):
     id: Optional[int]
     quantity: int
     order_statuses: Optional[str] = "PENDING"
     user_id: Optional[int]
     product_id: int
+    # when given, the update only applies if the order is still at this version
+    version: Optional[int] = None
+    # degrees; orders without a pickup point are never dispatched to a courier
+    pickup_lat: Optional[float] = None
+    pickup_lng: Optional[float] = None
+    dropoff_lat: Optional[float] = None
+    dropoff_lng: Optional[float] = None
 
     class Config:
         orm_model = True
@@ -54,8 +66,17 @@ class OrderModel(BaseModel):
         }
 
 
+def check_order_status(v):
+    if v is not None and v not in ("PENDING", "IN_TRANSIT", "DELIVERED"):
+        raise ValueError("Must be one of PENDING, IN_TRANSIT, DELIVERED")
+    return v
+
+
 class OrderStatusModel(BaseModel):
     order_statuses: Optional[str] = "PENDING"
+    version: Optional[int] = None
+
+    _check_order_statuses = validator('order_statuses', allow_reuse=True)(check_order_status)
 
     class Config:
         orm_model = True
@@ -66,10 +87,60 @@ class OrderStatusModel(BaseModel):
         }
 
 
+class OrderStatusFilterModel(BaseModel):
+    order_statuses: Optional[str] = None
+    user_id: Optional[int] = None
+    product_id: Optional[int] = None
+
+    _check_order_statuses = validator('order_statuses', allow_reuse=True)(check_order_status)
+
+
+class OrderStatusBulkModel(BaseModel):
+    order_statuses: str
+    # either explicit ids (optionally pinned to versions) or a filter
+    ids: Optional[List[int]] = None
+    versions: Optional[Dict[int, int]] = None
+    filter: Optional[OrderStatusFilterModel] = None
+
+    _check_order_statuses = validator('order_statuses', allow_reuse=True)(check_order_status)
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "order_statuses": "IN_TRANSIT",
+                "ids": [1, 2, 3],
+                "versions": {"1": 1}
+            }
+        }
+
+
+class CourierModel(BaseModel):
+    name: str
+    is_active: Optional[bool] = True
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "name": "Aziz",
+                "lat": 41.3111,
+                "lng": 69.2797
+            }
+        }
+
+
+class CourierLocationModel(BaseModel):
+    lat: float
+    lng: float
+    is_active: Optional[bool] = None
+
+
 class ProductModel(BaseModel):
     id: Optional[int]
-    name: str
-    price: int
+    # the product table's limits, so a row the database would refuse fails validation instead
+    name: constr(max_length=100)
+    price: conint(ge=-2 ** 31, le=2 ** 31 - 1)
 
     class Config:
         orm_model = True
@@ -79,3 +150,36 @@ class ProductModel(BaseModel):
                 "price": 30000
             }
         }
+
+
+class ProductOut(BaseModel):
+    id: int
+    name: str
+    price: int
+
+
+class ProductPage(BaseModel):
+    data: List[ProductOut]
+    next_cursor: Optional[str]
+
+
+class UserOut(BaseModel):
+    id: int
+    username: str
+    email: str
+
+
+class OrderOut(BaseModel):
+    id: int
+    quantity: int
+    order_statuses: str
+    product: Optional[ProductOut]
+    unit_price: Optional[int]
+    total_price: Optional[int]
+    version: int
+    user: UserOut
+
+
+class OrderPage(BaseModel):
+    data: List[OrderOut]
+    next_cursor: Optional[str]
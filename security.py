@@ -0,0 +1,39 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Any werkzeug method string, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+PASSWORD_SALT_LENGTH = int(os.getenv('PASSWORD_SALT_LENGTH', '16'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# hashlib releases the GIL while hashing, so a small thread pool runs hashes in
+# parallel while keeping them off the event loop and capping CPU spent on them
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+
+
+async def _run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def hash_password(password):
+    return await _run(generate_password_hash, password,
+                      method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_SALT_LENGTH)
+
+
+async def verify_password(pwhash, password):
+    return await _run(check_password_hash, pwhash, password)
+
+
+@functools.lru_cache(maxsize=None)
+def _current_method():
+    # werkzeug fills in defaults for partial methods ('pbkdf2' -> 'pbkdf2:sha256:<n>')
+    return generate_password_hash('', method=PASSWORD_HASH_METHOD, salt_length=1).split('$', 1)[0]
+
+
+async def needs_rehash(pwhash):
+    return pwhash.split('$', 1)[0] != await _run(_current_method)